@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    Backtest scoring parameters.
+
+    Replays match history with every combination of given parameters, and
+    reports how often higher scored side won the match.
+'''
+
+import logging, sys
+import json
+
+from datetime import datetime
+
+from kayfabe.backtest import grid, sweep
+from kayfabe.rating import ENGINES, KayfabeEngine, EVENT_MODIFIERS, RESOLUTION_PENALTIES
+from kayfabe.replay import Timeline
+
+
+def values(s):
+    ''' Parse comma separated numbers. '''
+    return [float(v) for v in s.split(',')]
+
+
+def keyed_values(s):
+    ''' Parse "KEY=1,2,3" into (KEY, [1, 2, 3]). '''
+    key, _, v = s.rpartition('=')
+    return (key.upper(), values(v))
+
+
+def modifier_sets(defaults, choices):
+    ''' Modifier dicts from every combination of keyed choices. '''
+    return [dict(defaults, **combination) for combination in grid(**dict(choices))]
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    cmdline = argparse.ArgumentParser(description='Backtest scoring parameters.')
+
+    cmdline.add_argument('--engine', help='Rating engine.', choices=list(ENGINES), default=KayfabeEngine.name)
+    cmdline.add_argument('--param', help='Engine parameter values, as NAME=1,2,3.', action='append',
+                         type=keyed_values, default=[])
+
+    cmdline.add_argument('--difference-maker', help='DIFFERENCE_MAKER values, as 1,2,3.', type=values)
+    cmdline.add_argument('--championship-increment', help='CHAMPIONSHIP_INCREMENT values.', type=values)
+    cmdline.add_argument('--event-modifier', help='EVENT_MODIFIERS values, as "PAY PER VIEW=10,17".',
+                         action='append', type=keyed_values, default=[])
+    cmdline.add_argument('--resolution-penalty', help='RESOLUTION_PENALTIES values, as DQ=1,1.5.',
+                         action='append', type=keyed_values, default=[])
+
+    cmdline.add_argument('--timeline', help='Read matches from timeline exported by export-matches.util.py.')
+    cmdline.add_argument('--since', help='Count predictions on and after date (YYYY-MM-DD).',
+                         type=lambda d: datetime.strptime(d, '%Y-%m-%d').date())
+    cmdline.add_argument('--processes', help='Worker processes. Defaults to CPU count.', type=int)
+    cmdline.add_argument('--json', help='Output results as JSON.', action='store_true')
+    cmdline.add_argument('--debug', help='Debug', action='store_true')
+
+    args = cmdline.parse_args()
+
+    if args.debug:
+        logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+    else:
+        logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+
+    choices = {name.lower(): v for (name, v) in args.param}
+
+    if args.engine == KayfabeEngine.name:
+        if args.difference_maker:
+            choices['difference_maker'] = args.difference_maker
+        if args.championship_increment:
+            choices['championship_increment'] = args.championship_increment
+        if args.event_modifier:
+            choices['event_modifiers'] = modifier_sets(EVENT_MODIFIERS, args.event_modifier)
+        if args.resolution_penalty:
+            choices['resolution_penalties'] = modifier_sets(RESOLUTION_PENALTIES, args.resolution_penalty)
+
+    param_sets = grid(**choices)
+
+    if args.timeline:
+        timeline = Timeline.open(args.timeline)
+    else:
+        timeline = Timeline.load()
+    logging.info('Backtesting %d parameter sets over %d matches', len(param_sets), len(timeline))
+
+    results = sweep(timeline, param_sets, ENGINES[args.engine], since=args.since, processes=args.processes)
+    results.sort(key=lambda r: r[1].accuracy or 0, reverse=True)
+
+    if args.json:
+        print(json.dumps([
+            dict(params=params, accuracy=p.accuracy, correct=p.correct, ties=p.ties, matches=p.matches)
+            for (params, p) in results
+        ], indent=2))
+    else:
+        for (params, p) in results:
+            print('{accuracy:.4f} ({correct}/{matches}, {ties} ties): {params}'.format(
+                accuracy=p.accuracy or 0, correct=p.correct, matches=p.matches, ties=p.ties, params=params
+            ))
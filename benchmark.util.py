@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    Benchmark pipeline against synthetic database.
+
+    Generates database and cached match pages with kayfabe.synthetic, and
+    times scoring, ranking, stats, match parsing, thumbnailing and page
+    compiling. Results are written as JSON, to compare across commits.
+'''
+
+import logging, sys
+
+import glob
+import importlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+
+from contextlib import redirect_stdout
+from datetime import datetime
+from time import perf_counter
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# Wrestlers to write match pages and images for.
+SAMPLE_WRESTLERS = 20
+
+
+class Skip(Exception):
+    ''' Raised by benchmark stage which can't run here, with reason. '''
+
+
+def run_stage(results, name, func, repeat=1):
+    ''' Run benchmark stage, and record its timings into results.
+
+        Stage is marked skipped if it raises Skip, or ImportError when
+        optional dependency is missing.
+    '''
+    result = {'status': 'ok', 'seconds': []}
+
+    for _ in range(repeat):
+        try:
+            with redirect_stdout(io.StringIO()):
+                start = perf_counter()
+                func()
+                result['seconds'].append(perf_counter() - start)
+
+        except (ImportError, Skip) as e:
+            result = {'status': 'skipped', 'reason': str(e)}
+            break
+        except Exception as e:
+            logging.exception('Benchmark %s failed', name)
+            result = {'status': 'error', 'reason': '%s: %s' % (type(e).__name__, e)}
+            break
+
+    if result['status'] == 'ok':
+        result['best'] = min(result['seconds'])
+
+    logging.info('%s: %s', name, result.get('best', result['status']))
+    results[name] = result
+
+
+def load_script(name):
+    ''' Import repository script as module. '''
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_').replace('.', '_'),
+                                                  os.path.join(BASE_DIR, name))
+    module = importlib.util.module_from_spec(spec)
+    with redirect_stdout(io.StringIO()):
+        spec.loader.exec_module(module)
+    return module
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_images(path, nrs, size=(400, 300)):
+    ''' Write noise images for wrestlers, named as kayfabe.view expects. '''
+    from PIL import Image
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    os.makedirs(path, exist_ok=True)
+
+    images = []
+    for nr in nrs:
+        pixels = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+        name = os.path.join(path, '{:0>8}.jpg'.format(nr))
+        Image.fromarray(pixels).save(name)
+        images.append(name)
+
+    return images
+
+
+def prepare_site(workdir):
+    ''' Link templates and assets into site directory, and compile
+        translation catalogues there, as only their sources are tracked.
+    '''
+    assets = os.path.join(workdir, 'ass')
+    os.makedirs(assets, exist_ok=True)
+
+    links = [('tpl', workdir)] + [(os.path.join('ass', a), assets)
+                                  for a in os.listdir(os.path.join(BASE_DIR, 'ass')) if a != 'locale']
+    for (src, dst) in links:
+        link = os.path.join(dst, os.path.basename(src))
+        if not os.path.lexists(link):
+            os.symlink(os.path.join(BASE_DIR, src), link)
+
+    locale = os.path.join(assets, 'locale')
+    if os.path.islink(locale):
+        os.remove(locale)
+
+    catalogues = glob.glob(os.path.join(BASE_DIR, 'ass', 'locale', '*', 'LC_MESSAGES', '*.po'))
+    if catalogues and not shutil.which('msgfmt'):
+        raise Skip('msgfmt not found, needed to compile translations')
+
+    for po in catalogues:
+        mo = os.path.join(assets, os.path.relpath(os.path.splitext(po)[0] + '.mo', os.path.join(BASE_DIR, 'ass')))
+        os.makedirs(os.path.dirname(mo), exist_ok=True)
+        subprocess.run(['msgfmt', '-o', mo, po], check=True)
+
+
+def benchmark(args, data_dir):
+    from kayfabe import session
+    from kayfabe.models import Match, Wrestler
+    from kayfabe.scoring import Ranking
+    from kayfabe.stats import get_biggest_cheater, match_ending_stats
+
+    from sqlalchemy import func
+
+    results = {}
+    repeat = args.repeat
+
+    scores = load_script('scores.py')
+    scores.prepare_database()
+
+    run_stage(results, 'scoring.full', lambda: scores.rescore(processes=1), repeat)
+    run_stage(results, 'scoring.parallel', lambda: scores.rescore(processes=args.processes), repeat)
+
+    first, last = session.query(func.min(Match.date), func.max(Match.date)).one()
+    half = first + (last - first) / 2
+
+    run_stage(results, 'scoring.from_date', lambda: scores.rescore(half, processes=1), repeat)
+
+    from_date = last - (last - first) / 20
+    sample = [nr for (nr,) in session.query(Wrestler.nr).order_by(Wrestler.nr).limit(SAMPLE_WRESTLERS)]
+
+    def ranking():
+        ranking = Ranking(limit=1000, from_date=from_date, to_date=last)
+        for w in ranking:
+            ranking.get_rank(w)
+            ranking.get_previous_rank(w)
+            ranking.get_score(w)
+
+    run_stage(results, 'ranking', ranking, repeat)
+
+    def stats():
+        cheater = get_biggest_cheater(from_date, last)
+        if cheater is not None:
+            match_ending_stats(cheater, from_date, last)
+
+    run_stage(results, 'stats', stats, repeat)
+
+    scraper = load_script('scrape-matches.util.py')
+    scraper.cm = scraper.cagematchnet
+    scraper.CACHE_FILE = os.path.join(data_dir, 'pages', 'cm-matches-{wrestler}-{offset}.txt')
+
+    def parsing():
+        try:
+            for nr in sample:
+                scraper.scrape_matches(nr)
+        finally:
+            session.rollback()
+
+    run_stage(results, 'parsing', parsing, repeat)
+
+    def thumbnails():
+        from kayfabe.Image import get_thumb
+
+        images = write_images(os.path.join(data_dir, 'img', 'w'), sample)
+        with tempfile.TemporaryDirectory() as thumb_path:
+            for image in images:
+                get_thumb(image, thumb_path=thumb_path)
+
+    run_stage(results, 'thumbnails', thumbnails, repeat)
+
+    workdir = os.path.join(data_dir, 'site')
+
+    def compile_page():
+        ''' compile-page.py reads templates and assets relative to working
+            directory. Images are pregenerated, so no faces are fetched.
+        '''
+        import PIL
+
+        if not shutil.which('lessc'):
+            raise Skip('lessc not found')
+
+        prepare_site(workdir)
+
+        write_images(os.path.join(workdir, 'ass', 'img', 'w'),
+                     [nr for (nr,) in session.query(Wrestler.nr).order_by(Wrestler.nr)])
+
+        proc = subprocess.run([sys.executable, os.path.join(BASE_DIR, 'compile-page.py'), '--output-file',
+                               os.path.join(workdir, 'index.html')], cwd=workdir, env=os.environ,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode:
+            raise RuntimeError(proc.stderr.decode().strip().splitlines()[-1:])
+
+    run_stage(results, 'compile-page', compile_page, repeat)
+
+    return results
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    cmdline = argparse.ArgumentParser(description='Benchmark against synthetic database.')
+
+    cmdline.add_argument('--data-dir', help='Database and cached pages. Generated if missing. Temporary if not given.')
+    cmdline.add_argument('--wrestlers', help='Wrestler count.', type=int, default=1000)
+    cmdline.add_argument('--matches', help='Match count.', type=int, default=50000)
+    cmdline.add_argument('--promotions', help='Promotion count.', type=int, default=20)
+    cmdline.add_argument('--seed', help='Random seed.', type=int, default=0)
+    cmdline.add_argument('--repeat', help='Repeat stages, best time is reported.', type=int, default=1)
+    cmdline.add_argument('--processes', help='Replay worker processes. Defaults to CPU count.', type=int)
+    cmdline.add_argument('--generate-only', help='Only generate data.', action='store_true')
+    cmdline.add_argument('--output', help='Output JSON file. Defaults to stdout.')
+    cmdline.add_argument('--debug', help='Debug', action='store_true')
+
+    args = cmdline.parse_args()
+
+    if args.debug:
+        logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+    else:
+        logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='kayfabe-benchmark-')
+    db_file = os.path.join(data_dir, 'cagematch.sqlite3')
+    os.makedirs(data_dir, exist_ok=True)
+
+    ''' Database is chosen on kayfabe import. '''
+    os.environ['KAYFABE_DB'] = db_file
+
+    from kayfabe import session
+    from kayfabe.models import Wrestler
+    from kayfabe.synthetic import generate, write_match_pages
+
+    config = {
+        'wrestlers': args.wrestlers,
+        'matches': args.matches,
+        'promotions': args.promotions,
+        'seed': args.seed
+    }
+
+    if not os.path.exists(db_file):
+        logging.info('Generating %s', config)
+        start = perf_counter()
+        generate(**config)
+
+        os.makedirs(os.path.join(data_dir, 'pages'), exist_ok=True)
+        nrs = [nr for (nr,) in session.query(Wrestler.nr).order_by(Wrestler.nr).limit(SAMPLE_WRESTLERS)]
+        write_match_pages(os.path.join(data_dir, 'pages', 'cm-matches-{wrestler}-{offset}.txt'), nrs)
+
+        logging.info('Generated in %.1fs into %s', perf_counter() - start, data_dir)
+
+        with open(os.path.join(data_dir, 'config.json'), 'w') as f:
+            json.dump(config, f)
+    else:
+        ''' Existing data decides configuration. '''
+        with open(os.path.join(data_dir, 'config.json')) as f:
+            config = json.load(f)
+
+    if args.generate_only:
+        sys.exit()
+
+    output = {
+        'commit': commit(),
+        'date': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'config': config,
+        'results': benchmark(args, data_dir)
+    }
+
+    output = json.dumps(output, indent=2)
+    if args.output:
+        open(args.output, 'w').write(output)
+    else:
+        print(output)
@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 from kayfabe import BASE_SCORE, session
+from kayfabe.events import events
+from kayfabe.history import top_jumps
 from kayfabe.models import *
 from kayfabe.scrapper import WikiData
 from kayfabe.view import *
@@ -26,20 +28,7 @@ import json
 from subprocess import call, check_output
 
 def get_riser_stuff(wrestler):
-    scores = session.query(Score).filter_by(wrestler_nr=wrestler.nr).\
-        join(Match).order_by(asc(Match.date))
-
-    matches = []
-
-    prev_score = BASE_SCORE
-
-    for score in scores:
-        score_diff = score.score / prev_score
-        prev_score = score.score
-        matches.append((score_diff, score.match))
-
-    top = sorted(matches, key=lambda diff: diff[0], reverse=True)[0:5]
-    return [i[1] for i in top]
+    return [score.match for score in top_jumps(5, wrestler.nr)]
 
 def get_event_stuff(wrestler):
     logger.debug('Event stuff for wrestler %s', wrestler.name)
@@ -64,6 +53,9 @@ def get_event_stuff(wrestler):
 
 def carousel_cheater(date_from, date_to):
     cheater = get_biggest_cheater(date_from, date_to)
+    if cheater is None:
+        return None
+
     cheater_stats = match_ending_stats(cheater, date_from, date_to)
 
     return ('carousel-cheater.tpl.html', {
@@ -125,48 +117,24 @@ if __name__ == '__main__':
     tpl.filters['timetag'] = format_datetime
     tpl.filters['img'] = get_image_path
 
-    to_date = date.today()
-    from_date = date(to_date.year, to_date.month, 1) - 3 * timedelta(days=30)
+    from_date, to_date = ranking_period()
 
     promotions = dict()
 
-    ranking = Ranking(limit=limit, from_date=from_date, to_date=to_date)
+    ranking = Ranking(limit=limit, from_date=from_date, to_date=to_date, preload=True)
 
-    # Find highest riser, and worst
-    max_r_risen = max_s_risen = -10000
-    max_r_dropped = -1
-    score_riser = rank_riser = rank_dropper = None
     for w in ranking:
 
         logger.info("Processing Wrestler %s [%d]", w.name, w.nr)
 
-        if w.promotion_id not in promotions:
-            promotions[w.promotion_id] = session.query(Promotion).filter_by(cm_id=w.promotion_id).one()
-
-        rank = ranking.get_rank(w)
-        prev_rank = ranking.get_previous_rank(w)
-
-        if prev_rank is None or rank is None:
-            continue
+        if w.promotion is not None and w.promotion_id not in promotions:
+            promotions[w.promotion_id] = w.promotion
 
-        score = ranking.get_score(w)
-        prev_score = ranking.get_previous_score(w)
-
-        rank_diff = prev_rank - rank
-        score_diff = score / prev_score
-
-        if rank_diff > max_r_risen:
-            logger.debug("New rank riser: %s [%d], rised %d", w.name, w.nr, rank_diff)
-            max_r_risen = rank_diff
-            rank_riser = w
-        if score_diff > max_s_risen:
-            logger.debug("New score riser: %s [%d], rised %d", w.name, w.nr, rank_diff)
-            max_s_risen = score_diff
-            score_riser = w
-        if rank_diff < max_r_dropped:
-            logger.debug("New rank dropper: %s [%d], dropper %d", w.name, w.nr, rank_diff)
-            rank_dropper = w
-            max_r_dropped = rank_diff
+    # Find highest riser, and worst
+    movers = ranking.movers()
+    rank_riser, score_riser, rank_dropper = (
+        (movers[key] or [None])[0] for key in ('rank_risers', 'score_risers', 'droppers')
+    )
 
     carousel = []
 
@@ -182,13 +150,21 @@ if __name__ == '__main__':
     '''
 
 
-    carousel.append(carousel_rank_riser(rank_riser))
-    carousel.append(carousel_score_riser(score_riser))
-    carousel.append(carousel_cheater(date_from=ranking.from_date, date_to=to_date))
+    if rank_riser:
+        carousel.append(carousel_rank_riser(rank_riser))
+    if score_riser:
+        carousel.append(carousel_score_riser(score_riser))
+
+    cheater = carousel_cheater(date_from=ranking.from_date, date_to=to_date)
+    if cheater:
+        carousel.append(cheater)
+
+    leaderboards = ranking.leaderboards(10, events.keys())
 
     output = tpl.get_template('index.tpl.html').render(
         promotions=promotions,
         ranking=ranking,
+        leaderboards=leaderboards,
         config=config,
         carousel=carousel
     )
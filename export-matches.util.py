@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    Export match timeline as memory-mappable arrays, for replays without
+    database. See kayfabe.replay.Timeline.open().
+'''
+
+import logging, sys
+
+from kayfabe.replay import Timeline
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    cmdline = argparse.ArgumentParser(description='Export match timeline.')
+
+    cmdline.add_argument('path', help='Output directory.')
+    cmdline.add_argument('--debug', help='Debug', action='store_true')
+
+    args = cmdline.parse_args()
+
+    if args.debug:
+        logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+    else:
+        logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+
+    timeline = Timeline.load()
+    timeline.save(args.path)
+
+    logging.info('Exported %d matches, %d participants into %s', len(timeline), len(timeline.wrestler), args.path)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    Build head-to-head matrices of wrestlers, see kayfabe.headtohead.
+'''
+
+import logging, sys
+
+from datetime import datetime
+
+from kayfabe.headtohead import HeadToHead, HEAD_TO_HEAD_FILE
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    cmdline = argparse.ArgumentParser(description='Build head-to-head matrices.')
+
+    cmdline.add_argument('--from-date', help='Count matches on and after date (YYYY-MM-DD).',
+                         type=lambda d: datetime.strptime(d, '%Y-%m-%d').date())
+    cmdline.add_argument('--to-date', help='Count matches on and before date (YYYY-MM-DD).',
+                         type=lambda d: datetime.strptime(d, '%Y-%m-%d').date())
+    cmdline.add_argument('--output', help='Output npz file.', default=HEAD_TO_HEAD_FILE)
+    cmdline.add_argument('--debug', help='Debug', action='store_true')
+
+    args = cmdline.parse_args()
+
+    if args.debug:
+        logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+    else:
+        logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+
+    h2h = HeadToHead.build(args.from_date, args.to_date)
+    h2h.save(args.output)
+
+    logging.info('Saved head-to-head of %d wrestlers to %s', len(h2h), args.output)
@@ -6,6 +6,7 @@ from sqlalchemy.orm import sessionmaker
 
 import pandas as pd
 
+from os import environ
 from os.path import realpath
 
 from .events import events
@@ -15,7 +16,7 @@ BASE_SCORE=4000
 
 
 if not 'DB_FILE' in globals():
-	DB_FILE = realpath('%s/../../cagematch.sqlite3' % __file__)
+	DB_FILE = environ.get('KAYFABE_DB', realpath('%s/../../cagematch.sqlite3' % __file__))
 
 engine = create_engine('sqlite:///%s' % DB_FILE, echo=False)
 
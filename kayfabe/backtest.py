@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    Backtesting rating engines.
+
+    Replays in-memory timeline with different engine parameters, and
+    measures how well ratings predict match results.
+'''
+
+import itertools
+import logging
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .rating import KayfabeEngine
+from .replay import Timeline, stream
+
+logger = logging.getLogger(__name__)
+
+
+class Predictions():
+    ''' Counts how often higher rated side won.
+
+        Fed to :func:`kayfabe.replay.stream` before its engine, so it sees
+        ratings as they were before each match. Sides are compared by mean
+        score of their wrestlers.
+
+        :param engine:      Rating engine to evaluate.
+        :param since:       Count only matches on and after date.
+    '''
+
+    def __init__(self, engine, since=None):
+        self.engine = engine
+        self.since = since
+
+        self.correct = 0
+        self.ties = 0
+        self.matches = 0
+
+    def prepare(self, timeline: Timeline):
+        self._counted = None
+        if self.since is not None:
+            self._counted = timeline.date >= np.datetime64(self.since, 'D')
+
+    def rate(self, i, match_id, winners, losers):
+        if self._counted is not None and not self._counted[i]:
+            return
+
+        score = self.engine.score
+        winner = sum(score(nr) for nr in winners) / len(winners)
+        loser = sum(score(nr) for nr in losers) / len(losers)
+
+        self.matches += 1
+        if winner > loser:
+            self.correct += 1
+        elif winner == loser:
+            self.ties += 1
+
+    def rows(self):
+        return (self.correct, self.ties, self.matches)
+
+    @property
+    def accuracy(self):
+        ''' Share of correctly predicted matches, ties counting as half. '''
+        if not self.matches:
+            return None
+        return (self.correct + self.ties / 2) / self.matches
+
+
+def grid(**choices):
+    ''' Parameter sets from every combination of choices.
+
+        >>> grid(a=[1, 2], b=[3])
+        [{'a': 1, 'b': 3}, {'a': 2, 'b': 3}]
+    '''
+    names = list(choices)
+    return [dict(zip(names, values)) for values in itertools.product(*(choices[n] for n in names))]
+
+
+def backtest(timeline: Timeline, params=None, engine=KayfabeEngine, since=None):
+    ''' Replay timeline with engine parameters.
+
+        :return:            :class:`Predictions` of replay.
+    '''
+    rating = engine(**(params or {}))
+    predictions = Predictions(rating, since)
+    stream(timeline, [predictions, rating])
+    return predictions
+
+
+_timeline = None
+
+
+def _init_worker(timeline):
+    global _timeline
+    if isinstance(timeline, str):
+        timeline = Timeline.open(timeline)
+    _timeline = timeline
+
+
+def _backtest_worker(job):
+    params, engine, since = job
+    predictions = backtest(_timeline, params, engine, since)
+    # Ratings and match mask are not needed back.
+    predictions.engine = None
+    predictions._counted = None
+    return predictions
+
+
+def sweep(timeline: Timeline, param_sets, engine=KayfabeEngine, since=None, processes=None):
+    ''' Backtest parameter sets in a process pool.
+
+        Timeline is sent once to each worker process. Timeline opened from
+        disk is opened by workers instead, sharing the memory-map.
+
+        :param param_sets:  List of engine parameter dicts, see :func:`grid`.
+        :param engine:      Rating engine class.
+        :param since:       Count only matches on and after date.
+
+        :return:            List of (params, :class:`Predictions`), in
+                            param_sets order.
+    '''
+    processes = processes or os.cpu_count()
+    jobs = [(params, engine, since) for params in param_sets]
+
+    logger.debug('Backtesting %d parameter sets in %d processes', len(jobs), processes)
+
+    with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(timeline.path or timeline,)) as pool:
+        results = list(pool.map(_backtest_worker, jobs))
+
+    return list(zip(param_sets, results))
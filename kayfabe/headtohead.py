@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    Head-to-head records as sparse matrices.
+
+    Wins of wrestler i over wrestler j are wins[i, j], counted once for
+    every winner and loser pair of match. No contests are counted into
+    symmetric draws matrix for every pair of participants, as teams are
+    not known. Rows are CSR, so opponents of wrestler are one row slice.
+'''
+
+import logging
+
+from os.path import splitext
+
+import numpy as np
+
+from scipy.sparse import coo_matrix, csr_matrix
+
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
+
+from . import DB_FILE, session
+from .models import Match, MatchWrestler
+
+logger = logging.getLogger(__name__)
+
+# Head-to-head matrices saved next to database.
+HEAD_TO_HEAD_FILE = '%s-h2h.npz' % splitext(DB_FILE)[0]
+
+
+class HeadToHead():
+    ''' Win and draw counts between wrestlers.
+
+        :param nrs:         Sorted wrestler nrs of rows and columns.
+        :param wins:        CSR matrix of wins of row over column.
+        :param draws:       CSR matrix of no contests between row and column.
+    '''
+
+    def __init__(self, nrs, wins, draws):
+        self.nrs = nrs
+        self.wins = wins
+        self.losses = wins.T.tocsr()
+        self.draws = draws
+
+    def __len__(self):
+        return len(self.nrs)
+
+    def __contains__(self, nr):
+        return self._index(nr) is not None
+
+    @classmethod
+    def build(cls, from_date=None, to_date=None, session=session):
+        ''' Count head-to-head records from match results.
+
+            :param from_date:   Only matches on and after date.
+            :param to_date:     Only matches on and before date.
+        '''
+        pairs = []
+        for (a_resolution, b_resolution) in ((MatchWrestler.WINNER, MatchWrestler.LOSER),
+                                             (MatchWrestler.NC, MatchWrestler.NC)):
+            a = aliased(MatchWrestler)
+            b = aliased(MatchWrestler)
+
+            q = session.query(a.wrestler_id, b.wrestler_id, func.count()).\
+                join(b, (b.match_id == a.match_id) & (b.id != a.id)).\
+                filter(a.resolution == a_resolution).filter(b.resolution == b_resolution).\
+                filter(a.wrestler_id != None).filter(b.wrestler_id != None)
+
+            if from_date is not None or to_date is not None:
+                q = q.join(Match, Match.id == a.match_id)
+                if from_date is not None:
+                    q = q.filter(Match.date >= from_date)
+                if to_date is not None:
+                    q = q.filter(Match.date <= to_date)
+
+            rows = q.group_by(a.wrestler_id, b.wrestler_id).all()
+            pairs.append(np.array(rows, dtype=np.int64).reshape(-1, 3))
+
+        nrs = np.unique(np.concatenate([p[:, :2].ravel() for p in pairs]))
+        shape = (len(nrs), len(nrs))
+
+        (wins, draws) = (
+            coo_matrix((p[:, 2], (np.searchsorted(nrs, p[:, 0]), np.searchsorted(nrs, p[:, 1]))),
+                       shape=shape).tocsr()
+            for p in pairs
+        )
+
+        logger.debug('Built head-to-head of %d wrestlers, %d pairings', len(nrs), wins.nnz + draws.nnz)
+
+        return cls(nrs, wins, draws)
+
+    def save(self, path=HEAD_TO_HEAD_FILE):
+        ''' Save matrices as npz file. '''
+        np.savez_compressed(path, nrs=self.nrs,
+                            **{'%s_%s' % (name, part): getattr(getattr(self, name), part)
+                               for name in ('wins', 'draws') for part in ('data', 'indices', 'indptr')})
+
+    @classmethod
+    def load(cls, path=HEAD_TO_HEAD_FILE):
+        ''' Load matrices saved with save(). '''
+        with np.load(path) as f:
+            nrs = f['nrs']
+            (wins, draws) = (
+                csr_matrix((f[name + '_data'], f[name + '_indices'], f[name + '_indptr']), shape=(len(nrs), len(nrs)))
+                for name in ('wins', 'draws')
+            )
+
+        return cls(nrs, wins, draws)
+
+    def _index(self, nr):
+        i = np.searchsorted(self.nrs, nr)
+        if i < len(self.nrs) and self.nrs[i] == nr:
+            return i
+        return None
+
+    def _top(self, matrix, nr, n):
+        i = self._index(nr)
+        if i is None:
+            return []
+
+        row = matrix[i]
+        order = np.lexsort((self.nrs[row.indices], -row.data))[:n]
+        return [(self.nrs[row.indices[k]].item(), row.data[k].item()) for k in order]
+
+    def record(self, a, b):
+        ''' Record of wrestler a against wrestler b.
+
+            :return:            Tuple of (wins, losses, draws).
+        '''
+        (i, j) = (self._index(a), self._index(b))
+        if i is None or j is None:
+            return (0, 0, 0)
+
+        return (self.wins[i, j].item(), self.wins[j, i].item(), self.draws[i, j].item())
+
+    def most_beaten(self, nr, n=5):
+        ''' Opponents wrestler has beaten most.
+
+            :return:            List of (opponent nr, wins), most wins first.
+        '''
+        return self._top(self.wins, nr, n)
+
+    def beaten_by(self, nr, n=5):
+        ''' Opponents who have beaten wrestler most.
+
+            :return:            List of (opponent nr, losses), most first.
+        '''
+        return self._top(self.losses, nr, n)
+
+    def opponents(self, nr):
+        ''' Nrs of everyone wrestler has faced. '''
+        i = self._index(nr)
+        if i is None:
+            return self.nrs[:0]
+
+        met = self.wins[i] + self.losses[i] + self.draws[i]
+        return self.nrs[np.unique(met.indices)]
+
+    def common_opponents(self, a, b):
+        ''' Opponents both wrestlers have faced, with their records.
+
+            :return:            List of (opponent nr, record of a, record of b),
+                                with records as in record().
+        '''
+        common = np.intersect1d(self.opponents(a), self.opponents(b))
+        return [(nr.item(), self.record(a, nr), self.record(b, nr)) for nr in common if nr not in (a, b)]
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    Score history lookups.
+
+    Loads every wrestler's score history once into sorted arrays, and
+    answers "score as of date" queries by bisection, for single wrestlers
+    or thousands at once. Weekly rank snapshots are swept from same arrays.
+'''
+
+import logging
+
+from collections import deque
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from sqlalchemy import desc
+from sqlalchemy.orm import joinedload
+
+from . import BASE_SCORE, session
+from .models import Match, RankSnapshot, Score, Wrestler
+from .util import bulk_insert
+
+logger = logging.getLogger(__name__)
+
+
+class ScoreHistory():
+    ''' Score rows grouped by wrestler, in replay order.
+
+        Rows of wrestler ``nrs[k]`` are ``offsets[k]:offsets[k+1]``, sorted by
+        (date, -match id, score id), so the last row on or before a date is
+        the score as it stood at the end of that day.
+    '''
+
+    def __init__(self, nrs, offsets, date, match_id, score):
+        self.nrs = nrs
+        self.offsets = offsets
+        self.date = date
+        self.match_id = match_id
+        self.score = score
+
+        # Sorted (wrestler, day) keys of rows, for batch bisection.
+        self._first = int(date.min().astype(np.int64)) - 1 if len(date) else 0
+        self._span = int(date.max().astype(np.int64)) - self._first + 1 if len(date) else 1
+        segment = np.repeat(np.arange(len(nrs), dtype=np.int64), np.diff(offsets))
+        self._keys = segment * self._span + (date.astype(np.int64) - self._first)
+
+    def __len__(self):
+        return len(self.nrs)
+
+    def __contains__(self, nr):
+        return self._segment(np.asarray([nr]))[0] >= 0
+
+    @classmethod
+    def load(cls, session=session, wrestlers=None, model=Score):
+        ''' Load score history from database.
+
+            :param wrestlers:   Limit to wrestler nrs.
+            :param model:       Score table model, see :mod:`kayfabe.rating`.
+        '''
+        q = session.query(model.wrestler_nr, Match.date, model.match_id, model.score, model.id).\
+            join(Match, Match.id == model.match_id)
+        if wrestlers is not None:
+            q = q.filter(model.wrestler_nr.in_(wrestlers))
+        rows = q.all()
+
+        wrestler_nr = np.array([r[0] for r in rows], dtype=np.int64)
+        date = np.array([r[1] for r in rows], dtype='datetime64[D]')
+        match_id = np.array([r[2] for r in rows], dtype=np.int64)
+        score = np.array([r[3] for r in rows], dtype=np.float64 if model is not Score else np.int64)
+        score_id = np.array([r[4] for r in rows], dtype=np.int64)
+
+        order = np.lexsort((score_id, -match_id, date, wrestler_nr))
+
+        nrs, counts = np.unique(wrestler_nr, return_counts=True)
+        offsets = np.zeros(len(nrs) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        logger.debug('Loaded score history of %d wrestlers, %d scores', len(nrs), len(rows))
+
+        return cls(nrs, offsets, date[order], match_id[order], score[order])
+
+    def _segment(self, nrs):
+        ''' Segment index of wrestler nrs, -1 if not found. '''
+        if not len(self.nrs):
+            return np.full(np.shape(nrs), -1, dtype=np.int64)
+
+        k = np.minimum(np.searchsorted(self.nrs, nrs), len(self.nrs) - 1)
+        return np.where(self.nrs[k] == nrs, k, -1)
+
+    def history(self, nr):
+        ''' Score history of wrestler.
+
+            :return:            Tuple of (date, match_id, score) arrays.
+        '''
+        k = self._segment(np.asarray([nr]))[0]
+        if k < 0:
+            return tuple(a[:0] for a in (self.date, self.match_id, self.score))
+
+        s = slice(self.offsets[k], self.offsets[k+1])
+        return (self.date[s], self.match_id[s], self.score[s])
+
+    def index(self, nrs, on):
+        ''' Row of last score on or before date.
+
+            :param nrs:         Wrestler nrs.
+            :param on:          Date, or array of dates broadcasting with nrs.
+
+            :return:            Array of row indexes, -1 where wrestler had no
+                                score yet.
+        '''
+        nrs, on = np.broadcast_arrays(np.asarray(nrs, dtype=np.int64),
+                                      np.asarray(on, dtype='datetime64[D]'))
+
+        k = self._segment(nrs)
+        day = np.clip(on.astype(np.int64) - self._first, 0, self._span - 1)
+
+        row = np.searchsorted(self._keys, np.maximum(k, 0) * self._span + day, side='right') - 1
+        found = (k >= 0) & (row >= self.offsets[np.maximum(k, 0)])
+
+        return np.where(found, row, -1)
+
+    def scores_at(self, nrs, on, default=BASE_SCORE):
+        ''' Scores of wrestlers as of date.
+
+            :param default:     Score of wrestler without scores yet. None
+                                gives NaN.
+        '''
+        row = self.index(nrs, on)
+        found = row >= 0
+
+        if default is None:
+            default = np.nan
+        result = np.full(row.shape, default, dtype=np.result_type(self.score, np.asarray(default)))
+        result[found] = self.score[row[found]]
+
+        return result
+
+    def score_at(self, nr, on, default=BASE_SCORE):
+        ''' Score of wrestler as of date. '''
+        row = self.index([nr], on)[0]
+        return self.score[row].item() if row >= 0 else default
+
+    def deltas(self, nrs, start, end, default=BASE_SCORE):
+        ''' Score changes of wrestlers between end of start date and end of end date. '''
+        return self.scores_at(nrs, end, default) - self.scores_at(nrs, start, default)
+
+    def delta(self, nr, start, end, default=BASE_SCORE):
+        ''' Score change of wrestler between dates. '''
+        return self.deltas([nr], start, end, default)[0].item()
+
+
+def top_jumps(n=5, wrestler=None, from_date=None, to_date=None, session=session):
+    ''' Biggest single match score gains, read from score delta indexes.
+
+        :param wrestler:    Wrestler nr, all wrestlers if None.
+        :param from_date:   Only matches on and after date.
+        :param to_date:     Only matches on and before date.
+
+        :return:            List of scores, with their matches loaded.
+    '''
+    q = session.query(Score).options(joinedload(Score.match))
+    if wrestler is not None:
+        q = q.filter(Score.wrestler_nr == wrestler)
+    if from_date is not None or to_date is not None:
+        q = q.join(Match, Match.id == Score.match_id)
+        if from_date is not None:
+            q = q.filter(Match.date >= from_date)
+        if to_date is not None:
+            q = q.filter(Match.date <= to_date)
+
+    return q.filter(Score.delta != None).order_by(desc(Score.delta), Score.id).limit(n).all()
+
+
+# Weekday of rank snapshots, Sunday.
+SNAPSHOT_WEEKDAY = 6
+
+
+def weekly_ranks(history: ScoreHistory, window_length, wrestlers=None, weekday=SNAPSHOT_WEEKDAY, until=None):
+    ''' Sweep score history once, ranking wrestlers by best score within
+        window at end of every week, as :class:`kayfabe.scoring.Ranking` does.
+
+        Window maximum of each wrestler is kept in a monotonic deque of
+        (day, score), decreasing by score, so every score row is pushed and
+        popped once.
+
+        :param window_length:   Window length in days, before week end.
+        :param wrestlers:       Rank only these wrestler nrs.
+        :param until:           Last week end, defaults to today. Weeks after
+                                week of last score are never ranked.
+
+        :return:            Generator of (week end, nrs, ranks, scores).
+    '''
+    if not len(history.date):
+        return
+
+    owner = np.repeat(history.nrs, np.diff(history.offsets))
+    order = np.argsort(history.date, kind='stable')
+
+    days = history.date[order].astype(np.int64).tolist()
+    nrs = owner[order].tolist()
+    scores = history.score[order].tolist()
+
+    if wrestlers is not None:
+        wrestlers = set(wrestlers)
+
+    first = history.date.min().astype(object)
+    week_end = first + timedelta(days=(weekday - first.weekday()) % 7)
+
+    last = history.date.max().astype(object)
+    last_week_end = min(last + timedelta(days=(weekday - last.weekday()) % 7), until or datetime.now().date())
+
+    windows = {}
+    i = 0
+
+    while week_end <= last_week_end:
+        end = np.datetime64(week_end, 'D').astype(np.int64).item()
+
+        while i < len(days) and days[i] <= end:
+            nr = nrs[i]
+            if wrestlers is None or nr in wrestlers:
+                window = windows.get(nr)
+                if window is None:
+                    window = windows[nr] = deque()
+                while window and window[-1][1] <= scores[i]:
+                    window.pop()
+                window.append((days[i], scores[i]))
+            i += 1
+
+        ranked = []
+        start = end - window_length
+        for (nr, window) in list(windows.items()):
+            while window and window[0][0] < start:
+                window.popleft()
+            if window:
+                ranked.append((nr, window[0][1]))
+            else:
+                del windows[nr]
+
+        if ranked:
+            week_nrs = np.array([r[0] for r in ranked], dtype=np.int64)
+            week_scores = np.array([r[1] for r in ranked])
+
+            # RANK(): one plus count of better scores.
+            ordered = np.sort(week_scores)
+            ranks = len(ordered) - np.searchsorted(ordered, week_scores, side='right') + 1
+
+            yield (week_end, week_nrs, ranks, week_scores)
+
+        week_end += timedelta(days=7)
+
+
+def write_rank_snapshots(window_length, history=None, session=session, batch_size=50000):
+    ''' Replace weekly rank snapshots of window length.
+
+        :return:            Count of written snapshots.
+    '''
+    if history is None:
+        history = ScoreHistory.load(session=session)
+
+    wrestlers = [nr for (nr,) in session.query(Wrestler.nr).all()]
+
+    session.query(RankSnapshot).filter_by(window_length=window_length).delete(synchronize_session=False)
+
+    columns = ('window_length', 'wrestler_nr', 'week_end', 'rank', 'score')
+    rows = []
+    count = 0
+
+    for (week_end, nrs, ranks, scores) in weekly_ranks(history, window_length, wrestlers):
+        rows.extend(zip([window_length] * len(nrs), nrs.tolist(), [week_end] * len(nrs),
+                        ranks.tolist(), scores.tolist()))
+
+        if len(rows) >= batch_size:
+            bulk_insert(RankSnapshot.__table__, columns, rows, session=session, batch_size=batch_size)
+            count += len(rows)
+            rows = []
+
+    bulk_insert(RankSnapshot.__table__, columns, rows, session=session, batch_size=batch_size)
+    count += len(rows)
+
+    logger.debug('Wrote %d rank snapshots of %d day window', count, window_length)
+
+    return count
+
+
+def rank_trajectory(nr, window_length, from_date=None, to_date=None, session=session):
+    ''' Weekly rank and score of wrestler, from snapshots.
+
+        :return:            pandas.DataFrame of rank and score, indexed by week end.
+    '''
+    q = session.query(RankSnapshot.week_end, RankSnapshot.rank, RankSnapshot.score).\
+        filter_by(window_length=window_length, wrestler_nr=nr).order_by(RankSnapshot.week_end)
+    if from_date is not None:
+        q = q.filter(RankSnapshot.week_end >= from_date)
+    if to_date is not None:
+        q = q.filter(RankSnapshot.week_end <= to_date)
+
+    rows = q.all()
+    return pd.DataFrame({
+        'rank': [r[1] for r in rows],
+        'score': [r[2] for r in rows]
+    }, index=pd.DatetimeIndex([r[0] for r in rows], name='week_end'))
@@ -13,12 +13,6 @@ estimates predicted by the Kalman Smoother.
 '''
 
 import numpy as np
-import pylab as pl
-
-from pykalman import KalmanFilter
-
-import plotly.plotly as py
-from plotly.graph_objs import *
 
 from sqlalchemy import func
 
@@ -29,22 +23,91 @@ from dateutil.parser import parse
 
 from . import BASE_SCORE
 
+# Score trend model of batch_kalman_smooth(), a daily random walk observed
+# with noise.
+INITIAL_STATE_COVARIANCE = 1.0
+TRANSITION_COVARIANCE = 0.01
+OBSERVATION_COVARIANCE = 1.0
+
 def kalmafy(matches):
+	'''
+		Smooth score series, indexed by date, to daily trend.
+	'''
+	means = matches.resample('D').mean()
+
+	smoothed = batch_kalman_smooth(np.ma.masked_invalid(means.to_numpy()[np.newaxis, :]))
+
+	return pd.Series(index=means.index, data=smoothed[0])
 
-	means = matches.resample('D', how='mean')
 
-	observations_missing = np.ma.array(
-		means.get_values(),
-		mask=np.zeros(means.shape)
-	)
+def kalmafy_frame(matches):
+	'''
+		Smooth score frame, indexed by date with column per wrestler, to
+		daily trends. Days before wrestler's first score are NaN.
+	'''
+	means = matches.resample('D').mean()
 
-	for i, weekly in enumerate(observations_missing):
-		if pd.isnull(weekly):
-			observations_missing[i] = np.ma.masked
+	smoothed = batch_kalman_smooth(np.ma.masked_invalid(means.to_numpy().T))
 
-	smoothed = kalman_smooth(observations_missing)
+	return pd.DataFrame(smoothed.T, index=means.index, columns=means.columns)
 
-	return pd.Series(index=matches.index, data=smoothed)
+
+def batch_kalman_smooth(observations, initial_state_mean=BASE_SCORE,
+		initial_state_covariance=INITIAL_STATE_COVARIANCE, transition_covariance=TRANSITION_COVARIANCE,
+		observation_covariance=OBSERVATION_COVARIANCE):
+	'''
+		Kalman filter and RTS smooth many scalar random walks at once.
+
+		Same model as kalman_smooth() defaults, but series are rows of
+		masked 2-D array (wrestlers × days), and masked days have no
+		observation. Each row starts from initial state on its first
+		observed day, as if fitted alone from there.
+
+		:return:	Array of smoothed states, NaN before first observation.
+	'''
+	observations = np.ma.asarray(observations, dtype=np.float64)
+	(n, days) = observations.shape
+
+	observed = ~np.ma.getmaskarray(observations)
+	values = observations.filled(0.0)
+
+	first = np.where(observed.any(axis=1), observed.argmax(axis=1), days)
+
+	predicted_mean = np.empty((days, n))
+	predicted_covariance = np.empty((days, n))
+	filtered_mean = np.empty((days, n))
+	filtered_covariance = np.empty((days, n))
+
+	mean = np.full(n, initial_state_mean, dtype=np.float64)
+	covariance = np.full(n, initial_state_covariance, dtype=np.float64)
+
+	for t in range(days):
+		fresh = t <= first
+		mean = np.where(fresh, initial_state_mean, mean)
+		covariance = np.where(fresh, initial_state_covariance, covariance + transition_covariance)
+
+		predicted_mean[t] = mean
+		predicted_covariance[t] = covariance
+
+		gain = np.where(observed[:, t], covariance / (covariance + observation_covariance), 0.0)
+		mean = mean + gain * (values[:, t] - mean)
+		covariance = (1 - gain) * covariance
+
+		filtered_mean[t] = mean
+		filtered_covariance[t] = covariance
+
+	smoothed = np.empty((days, n))
+	if days:
+		smoothed[-1] = filtered_mean[-1]
+
+	for t in range(days - 2, -1, -1):
+		gain = filtered_covariance[t] / predicted_covariance[t+1]
+		smoothed[t] = filtered_mean[t] + gain * (smoothed[t+1] - predicted_mean[t+1])
+
+	smoothed = smoothed.T
+	smoothed[np.arange(days) < first[:, np.newaxis]] = np.nan
+
+	return smoothed
 
 
 def kalman_smooth(observations, **kwargs):
@@ -54,6 +117,8 @@ def kalman_smooth(observations, **kwargs):
 	kwargs.setdefault('initial_state_mean', BASE_SCORE)
 	kwargs.setdefault('transition_covariance', 0.01 * np.eye(1))
 
+	from pykalman import KalmanFilter
+
 	kf = KalmanFilter(**kwargs)
 
 	states_pred = kf.smooth(observations)[0]
@@ -2,7 +2,8 @@
 # -*- coding: utf-8 -*-
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, SmallInteger, String, Boolean, Date, ForeignKey
+from sqlalchemy import Column, Integer, SmallInteger, String, Boolean, Date, Float, ForeignKey, Index
+from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import relationship, backref
 
 from sqlalchemy.orm import sessionmaker
@@ -123,39 +124,161 @@ class Score(Base):
 	match_id = Column(Integer, ForeignKey('matches.id'))
 	wrestler_nr = Column(Integer, ForeignKey('wrestlers.nr'))
 	score = Column(Integer)
+	# Score change in match.
+	delta = Column(Integer)
 
 	wrestler = relationship("Wrestler")
 	match = relationship("Match")
 
+	__table_args__ = (
+		Index('ix_scores_wrestler_delta', 'wrestler_nr', 'delta'),
+		Index('ix_scores_delta', 'delta'),
+	)
 
+class CurrentScore(Base):
+	''' Latest score of each wrestler, kept up to date by scoring. '''
+	__tablename__ = 'wrestler_current_score'
 
+	wrestler_nr = Column(Integer, ForeignKey('wrestlers.nr'), primary_key=True)
+	score = Column(Integer)
+	last_match_id = Column(Integer, ForeignKey('matches.id'))
+	last_date = Column(Date, index=True)
 
+	wrestler = relationship("Wrestler")
+	last_match = relationship("Match")
 
-def get_matches(wrestler):
+class Watermark(Base):
+	''' Highest match id processed by pipeline step, such as scoring. '''
+	__tablename__ = 'watermarks'
+
+	name = Column(String, primary_key=True)
+	match_id = Column(Integer)
+
+class RankingScore(Base):
+	''' Wrestler's best score within ranking window, see kayfabe.scoring. '''
+	__tablename__ = 'rankings'
+
+	window_end = Column(Date, primary_key=True)
+	window_length = Column(Integer, primary_key=True)
+	wrestler_nr = Column(Integer, ForeignKey('wrestlers.nr'), primary_key=True)
+	score = Column(Integer)
+
+	wrestler = relationship("Wrestler")
+
+	__table_args__ = (
+		Index('ix_rankings_window_score', 'window_end', 'window_length', 'score'),
+	)
+
+class RankSnapshot(Base):
+	''' Weekly rank of wrestler, see kayfabe.history. '''
+	__tablename__ = 'rank_snapshots'
+
+	window_length = Column(Integer, primary_key=True)
+	wrestler_nr = Column(Integer, ForeignKey('wrestlers.nr'), primary_key=True)
+	week_end = Column(Date, primary_key=True)
+	rank = Column(Integer)
+	score = Column(Integer)
+
+	wrestler = relationship("Wrestler")
+
+class Trend(Base):
+	''' Online Kalman filter state of wrestler's score trend, see kayfabe.trend. '''
+	__tablename__ = 'wrestler_trends'
+
+	wrestler_nr = Column(Integer, ForeignKey('wrestlers.nr'), primary_key=True)
+	# Filtered trend as of last date.
+	mean = Column(Float, index=True)
+	covariance = Column(Float)
+	last_date = Column(Date)
+	# Prediction for last date, and sum and count of its scores.
+	prior_mean = Column(Float)
+	prior_covariance = Column(Float)
+	day_sum = Column(Float)
+	day_count = Column(Integer)
+
+	wrestler = relationship("Wrestler")
+
+class StatsCell(Base):
+	''' Match count of statistics cube cell, see kayfabe.stats.cube.
+
+	Unknown promotion is 0, unknown event type and resolution are empty.
 	'''
-		Get wrestler matches scores as pandas.Series(), indexed by date
+	__tablename__ = 'stats_cube'
+
+	promotion_id = Column(Integer, primary_key=True)
+	month = Column(Date, primary_key=True)
+	event_type = Column(String, primary_key=True)
+	resolution = Column(String, primary_key=True)
+	title_change = Column(Boolean, primary_key=True)
+	matches = Column(Integer)
+	# Highest match id counted into cell.
+	last_match_id = Column(Integer)
+
+class EngineScore():
+	''' Score table columns of alternative rating engines. '''
+	id = Column(Integer, primary_key=True)
+	score = Column(Float)
+	deviation = Column(Float)
+
+	@declared_attr
+	def match_id(cls):
+		return Column(Integer, ForeignKey('matches.id'), index=True)
+
+	@declared_attr
+	def wrestler_nr(cls):
+		return Column(Integer, ForeignKey('wrestlers.nr'), index=True)
+
+class EloScore(EngineScore, Base):
+	__tablename__ = 'scores_elo'
+
+class Glicko2Score(EngineScore, Base):
+	__tablename__ = 'scores_glicko2'
+
+class TrueSkillScore(EngineScore, Base):
+	__tablename__ = 'scores_trueskill'
+
+
+
+
+
+def get_score_frame(wrestlers, long=False, session=session):
 	'''
+		Get scores of many wrestlers with one query, as daily mean of
+		scores after each match of day.
 
-	matches = session.query(Score).filter_by(wrestler_nr=wrestler).join(Match).order_by(Match.date)
+		:param long:	Return only match days, as DataFrame of wrestler_nr,
+						date and score rows. Small for large rosters.
 
-	start_date = session.query(func.min(Match.date)).join(Score).filter_by(wrestler_nr=wrestler).one()[0]
-	end_date =   session.query(func.max(Match.date)).join(Score).filter_by(wrestler_nr=wrestler).one()[0]
+		:return:		DataFrame indexed by every day from first to last
+						match, with column per wrestler, NaN where wrestler
+						had no match.
+	'''
+	wrestlers = list(wrestlers)
 
-	rng = pd.date_range(start=start_date, end=end_date, freq='D')
-	s = pd.Series(index=rng)
+	q = session.query(Score.wrestler_nr, Match.date, Score.score).join(Match, Match.id == Score.match_id).\
+		filter(Score.wrestler_nr.in_(wrestlers)).filter(Match.date != None)
 
-	for match in matches.all():
-		old_score = s[match.match.date]
-		score = match.score
+	rows = pd.DataFrame(q.all(), columns=['wrestler_nr', 'date', 'score'])
+	rows['date'] = pd.to_datetime(rows['date'])
+	rows['score'] = rows['score'].astype(float)
 
-		# Calculate combined score. Is shit.
-		if not pd.isnull(old_score):
-			score = ( old_score + score ) / 2
+	means = rows.groupby(['wrestler_nr', 'date'])['score'].mean()
 
-		s.set_value(match.match.date,  score)
+	if long:
+		return means.reset_index()
 
-	return s
+	frame = means.unstack(level=0)
+	if len(frame):
+		frame = frame.reindex(pd.date_range(start=frame.index.min(), end=frame.index.max(), freq='D'))
 
+	frame = frame.reindex(columns=pd.Index(wrestlers, name='wrestler_nr'))
+	frame.index.name = 'date'
 
+	return frame
 
 
+def get_matches(wrestler):
+	'''
+		Get wrestler matches scores as pandas.Series(), indexed by date
+	'''
+	return get_score_frame([wrestler])[wrestler]
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    Rating engines.
+
+    Engine consumes matches one by one from timeline replay, keeping its
+    own ratings and score rows. Several engines can share single pass over
+    timeline, see :func:`kayfabe.replay.stream`.
+'''
+
+import math
+
+import numpy as np
+
+from . import BASE_SCORE
+from .models import Score, EloScore, Glicko2Score, TrueSkillScore
+
+RESOLUTION_PENALTIES={
+    'DQ': 1.5,
+    'COUNT OUT': 1.5
+}
+
+EVENT_MODIFIERS={
+    'HOUSE SHOW': 1,
+    'EVENT': 2,
+    'DARK MATCH': 2.5,
+    'TV-SHOW': 4,
+    'PAY PER VIEW': 17
+}
+
+CHAMPIONSHIP_INCREMENT = 1
+
+DIFFERENCE_MAKER = 5
+
+# Single winner against more losers than this is scored by rumble rules.
+RUMBLE_LOSERS = 5
+
+
+class RatingEngine():
+    ''' Base class for rating engines.
+
+        :param ratings:     Starting ratings as dict of wrestler nr -> rating.
+                            Updated in place.
+        :param params:      Engine parameters.
+    '''
+
+    name = None
+
+    # Score table model, and its columns in score rows.
+    model = None
+    columns = ('match_id', 'wrestler_nr', 'score', 'deviation')
+    dtypes = (np.int64, np.int64, np.float64, np.float64)
+
+    def __init__(self, ratings=None, **params):
+        self.ratings = {} if ratings is None else ratings
+        self.params = params
+        self._rows = tuple([] for _ in self.columns)
+
+    def prepare(self, timeline):
+        ''' Precompute per match values before replay. '''
+        pass
+
+    def rate(self, i, match_id, winners, losers):
+        ''' Rate match.
+
+            :param i:           Match position in timeline.
+            :param match_id:    Match id.
+            :param winners:     Winning wrestler nrs.
+            :param losers:      Losing wrestler nrs.
+        '''
+        raise NotImplementedError()
+
+    def score(self, nr):
+        ''' Comparable score of wrestler, higher is better. '''
+        raise NotImplementedError()
+
+    def rows(self):
+        ''' Score rows as tuple of arrays, in :attr:`columns` order. '''
+        return tuple(np.array(col, dtype=dtype) for col, dtype in zip(self._rows, self.dtypes))
+
+    def fork(self, nrs):
+        ''' New engine with same parameters, and ratings of given wrestlers. '''
+        ratings = self.ratings
+        return type(self)({nr: ratings[nr] for nr in nrs if nr in ratings}, **self.params)
+
+
+class KayfabeEngine(RatingEngine):
+    ''' The Bookstrong score. '''
+
+    name = 'kayfabe'
+
+    model = Score
+    columns = ('match_id', 'wrestler_nr', 'score', 'delta')
+    dtypes = (np.int64, np.int64, np.int64, np.int64)
+
+    def __init__(self, ratings=None, **params):
+        super().__init__(ratings, **params)
+
+        self.event_modifiers = params.get('event_modifiers', EVENT_MODIFIERS)
+        self.resolution_penalties = params.get('resolution_penalties', RESOLUTION_PENALTIES)
+        self.championship_increment = params.get('championship_increment', CHAMPIONSHIP_INCREMENT)
+        self.difference_maker = params.get('difference_maker', DIFFERENCE_MAKER)
+
+    def prepare(self, timeline):
+        self._event = timeline.event_modifiers(self.event_modifiers).tolist()
+        self._dq = timeline.resolution_penalties(self.resolution_penalties).tolist()
+        self._champ = timeline.championship_modifiers(self.championship_increment).tolist()
+
+    def score(self, nr):
+        return self.ratings.get(nr, BASE_SCORE)
+
+    def rate(self, i, match_id, winners, losers):
+        scores = self.ratings
+        get = scores.get
+
+        winner_score = 0
+        for nr in winners:
+            winner_score = winner_score + get(nr, BASE_SCORE)
+
+        rumble_rules = len(winners) == 1 and len(losers) > RUMBLE_LOSERS
+
+        if rumble_rules:
+            loser_score = 1
+            for nr in losers:
+                loser_score = max(loser_score, get(nr, BASE_SCORE), 1)
+        else:
+            loser_score = 0
+            for nr in losers:
+                loser_score = loser_score + get(nr, BASE_SCORE)
+
+        score_diff = math.sqrt((max(loser_score, 1) / max(1, winner_score)))
+
+        if len(winners) < len(losers) and not rumble_rules:
+            ''' Sanitize fatal 4 ways and more '''
+            score_diff = score_diff / math.sqrt(len(losers)/len(winners))
+
+        score_base = score_diff * self.difference_maker * self._event[i] * self._champ[i] / self._dq[i]
+        score_base = max(score_base, 1)
+
+        rows_match, rows_wrestler, rows_score, rows_delta = self._rows
+
+        for nr in winners:
+            before = get(nr, BASE_SCORE)
+            score = max(round(before + score_base), 1)
+            scores[nr] = score
+            rows_match.append(match_id)
+            rows_wrestler.append(nr)
+            rows_score.append(score)
+            rows_delta.append(score - before)
+
+        for nr in losers:
+            before = get(nr, BASE_SCORE)
+            score = max(round(before - score_base), 1)
+            scores[nr] = score
+            rows_match.append(match_id)
+            rows_wrestler.append(nr)
+            rows_score.append(score)
+            rows_delta.append(score - before)
+
+
+class EloEngine(RatingEngine):
+    ''' Elo rating, teams rated by their mean rating.
+
+        :param k:           K-factor.
+        :param initial:     Rating of unrated wrestler.
+    '''
+
+    name = 'elo'
+    model = EloScore
+
+    def __init__(self, ratings=None, **params):
+        super().__init__(ratings, **params)
+        self.k = params.get('k', 32)
+        self.initial = params.get('initial', 1500)
+
+    def score(self, nr):
+        return self.ratings.get(nr, self.initial)
+
+    def rate(self, i, match_id, winners, losers):
+        ratings = self.ratings
+        initial = self.initial
+
+        winner = sum(ratings.get(nr, initial) for nr in winners) / len(winners)
+        loser = sum(ratings.get(nr, initial) for nr in losers) / len(losers)
+
+        expected = 1 / (1 + 10 ** ((loser - winner) / 400))
+        delta = self.k * (1 - expected)
+
+        rows_match, rows_wrestler, rows_score, rows_deviation = self._rows
+
+        for (nrs, sign) in ((winners, 1), (losers, -1)):
+            for nr in nrs:
+                rating = ratings.get(nr, initial) + sign * delta
+                ratings[nr] = rating
+                rows_match.append(match_id)
+                rows_wrestler.append(nr)
+                rows_score.append(rating)
+                rows_deviation.append(None)
+
+
+class Glicko2Engine(RatingEngine):
+    ''' Glicko-2 rating.
+
+        Every match is rating period of its participants. Each winner is
+        rated against each loser, and vice versa.
+
+        :param tau:         System constant, constrains volatility change.
+        :param rating:      Rating of unrated wrestler.
+        :param deviation:   Rating deviation of unrated wrestler.
+        :param volatility:  Volatility of unrated wrestler.
+    '''
+
+    name = 'glicko2'
+    model = Glicko2Score
+
+    SCALE = 173.7178
+
+    EPSILON = 0.000001
+
+    def __init__(self, ratings=None, **params):
+        super().__init__(ratings, **params)
+        self.tau = params.get('tau', 0.5)
+        self.initial = (
+            (params.get('rating', 1500) - 1500) / self.SCALE,
+            params.get('deviation', 350) / self.SCALE,
+            params.get('volatility', 0.06)
+        )
+
+    @staticmethod
+    def _g(phi):
+        return 1 / math.sqrt(1 + 3 * phi * phi / (math.pi * math.pi))
+
+    def score(self, nr):
+        return 1500 + self.ratings.get(nr, self.initial)[0] * self.SCALE
+
+    def _volatility(self, phi, sigma, v, delta):
+        ''' New volatility, by Illinois algorithm. '''
+        tau = self.tau
+        a = math.log(sigma * sigma)
+
+        def f(x):
+            ex = math.exp(x)
+            return ex * (delta * delta - phi * phi - v - ex) / (2 * (phi * phi + v + ex) ** 2) - (x - a) / (tau * tau)
+
+        A = a
+        if delta * delta > phi * phi + v:
+            B = math.log(delta * delta - phi * phi - v)
+        else:
+            k = 1
+            while f(a - k * tau) < 0:
+                k += 1
+            B = a - k * tau
+
+        fA = f(A)
+        fB = f(B)
+        while abs(B - A) > self.EPSILON:
+            C = A + (A - B) * fA / (fB - fA)
+            fC = f(C)
+            if fC * fB <= 0:
+                A = B
+                fA = fB
+            else:
+                fA = fA / 2
+            B = C
+            fB = fC
+
+        return math.exp(A / 2)
+
+    def _update(self, player, opponents, outcome):
+        mu, phi, sigma = player
+        g = self._g
+
+        v_inv = 0
+        improvement = 0
+        for (mu_j, phi_j, _) in opponents:
+            g_j = g(phi_j)
+            expected = 1 / (1 + math.exp(-g_j * (mu - mu_j)))
+            v_inv += g_j * g_j * expected * (1 - expected)
+            improvement += g_j * (outcome - expected)
+
+        v = 1 / v_inv
+        sigma = self._volatility(phi, sigma, v, v * improvement)
+
+        phi = math.sqrt(phi * phi + sigma * sigma)
+        phi = 1 / math.sqrt(1 / (phi * phi) + 1 / v)
+
+        return (mu + phi * phi * improvement, phi, sigma)
+
+    def rate(self, i, match_id, winners, losers):
+        ratings = self.ratings
+        initial = self.initial
+
+        before_winners = [ratings.get(nr, initial) for nr in winners]
+        before_losers = [ratings.get(nr, initial) for nr in losers]
+
+        rows_match, rows_wrestler, rows_score, rows_deviation = self._rows
+
+        for (nrs, before, opponents, outcome) in ((winners, before_winners, before_losers, 1),
+                                                  (losers, before_losers, before_winners, 0)):
+            for (nr, player) in zip(nrs, before):
+                rating = self._update(player, opponents, outcome)
+                ratings[nr] = rating
+                rows_match.append(match_id)
+                rows_wrestler.append(nr)
+                rows_score.append(1500 + rating[0] * self.SCALE)
+                rows_deviation.append(rating[1] * self.SCALE)
+
+
+class TrueSkillEngine(RatingEngine):
+    ''' TrueSkill style rating of winning team against losing team, without
+        draws.
+
+        :param mu:          Mean skill of unrated wrestler.
+        :param sigma:       Skill deviation of unrated wrestler.
+        :param beta:        Performance deviation.
+        :param tau:         Dynamics factor, added to deviation each match.
+    '''
+
+    name = 'trueskill'
+    model = TrueSkillScore
+
+    def __init__(self, ratings=None, **params):
+        super().__init__(ratings, **params)
+        self.initial = (params.get('mu', 25.0), params.get('sigma', 25.0 / 3))
+        self.beta = params.get('beta', self.initial[1] / 2)
+        self.tau = params.get('tau', self.initial[1] / 100)
+
+    def score(self, nr):
+        return self.ratings.get(nr, self.initial)[0]
+
+    @staticmethod
+    def _v_w(t):
+        ''' Mean and variance corrections for win by margin t. '''
+        cdf = 0.5 * math.erfc(-t / math.sqrt(2))
+        if cdf < 1e-300:
+            v = -t
+        else:
+            v = math.exp(-t * t / 2) / math.sqrt(2 * math.pi) / cdf
+        return (v, v * (v + t))
+
+    def rate(self, i, match_id, winners, losers):
+        ratings = self.ratings
+        initial = self.initial
+        tau2 = self.tau * self.tau
+
+        players = []
+        for nr in winners + losers:
+            mu, sigma = ratings.get(nr, initial)
+            players.append((nr, mu, sigma * sigma + tau2))
+
+        c2 = sum(p[2] for p in players) + len(players) * self.beta * self.beta
+        c = math.sqrt(c2)
+
+        winner_mu = sum(p[1] for p in players[:len(winners)])
+        loser_mu = sum(p[1] for p in players[len(winners):])
+
+        v, w = self._v_w((winner_mu - loser_mu) / c)
+
+        rows_match, rows_wrestler, rows_score, rows_deviation = self._rows
+
+        for (k, (nr, mu, sigma2)) in enumerate(players):
+            sign = 1 if k < len(winners) else -1
+            mu = mu + sign * sigma2 / c * v
+            sigma = math.sqrt(sigma2 * max(1 - sigma2 / c2 * w, 0.0001))
+
+            ratings[nr] = (mu, sigma)
+            rows_match.append(match_id)
+            rows_wrestler.append(nr)
+            rows_score.append(mu)
+            rows_deviation.append(sigma)
+
+
+ENGINES = {engine.name: engine for engine in (KayfabeEngine, EloEngine, Glicko2Engine, TrueSkillEngine)}
@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    Columnar match timeline, and score replay over it.
+
+    Loads the whole match history once into NumPy arrays, and runs the
+    scoring formula over plain arrays instead of ORM objects.
+'''
+
+import heapq
+import json
+import logging
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from sqlalchemy import asc, bindparam, desc, func
+
+from . import BASE_SCORE, session
+from .models import CurrentScore, Match, MatchTitle, MatchWrestler, Score, Watermark
+from .rating import KayfabeEngine, RESOLUTION_PENALTIES, EVENT_MODIFIERS, CHAMPIONSHIP_INCREMENT
+from .util import bulk_insert
+
+logger = logging.getLogger(__name__)
+
+class Timeline():
+    ''' Match history as arrays, sorted by (date, -id).
+
+        Participants are stored in CSR layout: wrestlers of match ``i`` are
+        ``wrestler[offsets[i]:offsets[i+1]]``, with their resolution in
+        ``outcome``.
+    '''
+
+    # Arrays stored by :meth:`save`, one .npy file each.
+    FIELDS = ('match_id', 'date', 'event_type', 'event_types', 'resolution', 'resolutions',
+              'title_changes', 'offsets', 'wrestler', 'outcome')
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, match_id, date, event_type, event_types, resolution,
+                 resolutions, title_changes, offsets, wrestler, outcome):
+        self.match_id = match_id
+        self.date = date
+
+        # Upper-cased event type and resolution, as codes into label arrays.
+        self.event_type = event_type
+        self.event_types = event_types
+        self.resolution = resolution
+        self.resolutions = resolutions
+
+        self.title_changes = title_changes
+
+        self.offsets = offsets
+        self.wrestler = wrestler
+        self.outcome = outcome
+
+        # Directory timeline was opened from, if any.
+        self.path = None
+
+        self._id_order = None
+
+    def __len__(self):
+        return len(self.match_id)
+
+    @classmethod
+    def load(cls, session=session, from_date=None):
+        ''' Load timeline from database.
+
+            :param from_date:   Load only matches on and after date.
+        '''
+
+        def since(q):
+            if from_date is not None:
+                q = q.filter(Match.date >= from_date)
+            return q
+
+        rows = since(session.query(Match.id, Match.date, Match.type, Match.resolution)).\
+            order_by(asc(Match.date), desc(Match.id)).all()
+
+        match_id = np.array([r[0] for r in rows], dtype=np.int64)
+        date = np.array([r[1] for r in rows], dtype='datetime64[D]')
+
+        event_types, event_type = np.unique(
+            [(r[2] or '').upper() for r in rows], return_inverse=True)
+        resolutions, resolution = np.unique(
+            [(r[3] or '').upper() for r in rows], return_inverse=True)
+
+        timeline = cls(match_id, date, event_type, event_types, resolution, resolutions,
+                       np.zeros(len(rows), dtype=np.int64), None, None, None)
+
+        changes = since(session.query(MatchTitle.match_id, func.count(MatchTitle.id)).\
+            join(Match, Match.id == MatchTitle.match_id)).\
+            filter(MatchTitle.change == True).group_by(MatchTitle.match_id).all()
+        if changes:
+            pos, found = timeline.position([c[0] for c in changes])
+            timeline.title_changes[pos[found]] = np.array([c[1] for c in changes])[found]
+
+        participants = since(session.query(MatchWrestler.match_id, MatchWrestler.wrestler_id,
+                                           MatchWrestler.resolution).\
+            join(Match, Match.id == MatchWrestler.match_id)).\
+            order_by(MatchWrestler.match_id, MatchWrestler.id).all()
+
+        pos, found = timeline.position([p[0] for p in participants])
+        wrestler = np.array([p[1] for p in participants], dtype=np.int64)[found]
+        outcome = np.array([p[2] for p in participants], dtype=np.int8)[found]
+        pos = pos[found]
+
+        # Stable sort keeps participant row order within match.
+        order = np.argsort(pos, kind='stable')
+        timeline.offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pos, minlength=len(rows)), out=timeline.offsets[1:])
+
+        timeline.wrestler = wrestler[order]
+        timeline.outcome = outcome[order]
+
+        logger.debug('Loaded timeline of %d matches, %d participants', len(rows), len(order))
+
+        return timeline
+
+    def save(self, path):
+        ''' Save timeline as directory of .npy files, readable by :meth:`open`. '''
+        os.makedirs(path, exist_ok=True)
+
+        for field in self.FIELDS:
+            np.save(os.path.join(path, field + '.npy'), _compact(getattr(self, field)))
+
+        # Written last, marks timeline complete.
+        with open(os.path.join(path, 'timeline.json'), 'w') as f:
+            json.dump({'version': self.FORMAT_VERSION, 'matches': len(self),
+                       'participants': len(self.wrestler)}, f)
+
+        logger.debug('Saved timeline of %d matches into %s', len(self), path)
+
+    @classmethod
+    def open(cls, path, mmap_mode='r'):
+        ''' Open timeline saved by :meth:`save`.
+
+            Arrays are memory-mapped, so processes opening same timeline share
+            single page-cached copy.
+        '''
+        with open(os.path.join(path, 'timeline.json')) as f:
+            meta = json.load(f)
+
+        if meta['version'] != cls.FORMAT_VERSION:
+            raise ValueError('Unsupported timeline format version {v} in {path}'.format(v=meta['version'], path=path))
+
+        timeline = cls(*(np.load(os.path.join(path, field + '.npy'), mmap_mode=mmap_mode)
+                         for field in cls.FIELDS))
+        timeline.path = path
+
+        return timeline
+
+    def position(self, ids):
+        ''' Timeline positions of match ids.
+
+            :return:            Tuple of (positions, found mask). Positions of
+                                ids not in timeline are meaningless.
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+
+        if self._id_order is None:
+            self._id_order = np.argsort(self.match_id)
+        sorted_ids = self.match_id[self._id_order]
+
+        if not len(sorted_ids):
+            return (np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool))
+
+        pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return (self._id_order[pos], sorted_ids[pos] == ids)
+
+    def take(self, positions):
+        ''' New timeline of matches at positions, in given order. '''
+        positions = np.asarray(positions, dtype=np.int64)
+
+        starts = self.offsets[positions]
+        counts = self.offsets[positions + 1] - starts
+
+        offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        idx = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+
+        return Timeline(self.match_id[positions], self.date[positions],
+                        self.event_type[positions], self.event_types,
+                        self.resolution[positions], self.resolutions,
+                        self.title_changes[positions], offsets,
+                        self.wrestler[idx], self.outcome[idx])
+
+    def components(self):
+        ''' Label matches by connected component of wrestler/match graph.
+
+            Matches in different components share no wrestlers, directly or
+            through other matches, so their scores can be replayed separately.
+        '''
+        n = len(self)
+        nrs, node = np.unique(self.wrestler, return_inverse=True)
+        match = np.repeat(np.arange(n), np.diff(self.offsets))
+
+        graph = coo_matrix((np.ones(len(node), dtype=np.int8), (match, n + node)),
+                           shape=(n + len(nrs), n + len(nrs)))
+        _, labels = connected_components(graph, directed=False)
+
+        return labels[:n]
+
+    def event_modifiers(self, modifiers=EVENT_MODIFIERS):
+        ''' Per match event modifier. '''
+        table = np.array([modifiers.get(t, 1) for t in self.event_types], dtype=np.float64)
+        return table[self.event_type]
+
+    def resolution_penalties(self, penalties=RESOLUTION_PENALTIES):
+        ''' Per match resolution penalty. '''
+        table = np.array([penalties.get(r, 1) for r in self.resolutions], dtype=np.float64)
+        return table[self.resolution]
+
+    def championship_modifiers(self, increment=CHAMPIONSHIP_INCREMENT):
+        ''' Per match championship modifier. In wrestling, you only count changes. '''
+        return np.sqrt(1 + self.title_changes.astype(np.float64) * increment)
+
+
+def _compact(a):
+    ''' Array as smallest integer type holding its values. '''
+    if a.dtype.kind not in 'iu' or not len(a):
+        return a
+
+    low, high = int(a.min()), int(a.max())
+    if low < 0:
+        dtype = np.promote_types(np.min_scalar_type(low), np.min_scalar_type(-high - 1))
+    else:
+        dtype = np.min_scalar_type(high)
+
+    return a.astype(dtype)
+
+
+def stream(timeline: Timeline, engines):
+    ''' Feed timeline through rating engines in single pass.
+
+        Matches without both winners and losers are skipped.
+
+        :return:            List of score rows of each engine.
+    '''
+    for engine in engines:
+        engine.prepare(timeline)
+
+    match_ids = timeline.match_id.tolist()
+    offsets = timeline.offsets.tolist()
+    wrestler = timeline.wrestler.tolist()
+    outcome = timeline.outcome.tolist()
+
+    WINNER = MatchWrestler.WINNER
+    LOSER = MatchWrestler.LOSER
+
+    raters = [engine.rate for engine in engines]
+
+    for i in range(len(match_ids)):
+        winners = []
+        losers = []
+
+        for j in range(offsets[i], offsets[i+1]):
+            if outcome[j] == WINNER:
+                winners.append(wrestler[j])
+            elif outcome[j] == LOSER:
+                losers.append(wrestler[j])
+
+        if len(winners) == 0 or len(losers) == 0:
+            continue
+
+        for rate in raters:
+            rate(i, match_ids[i], winners, losers)
+
+    return [engine.rows() for engine in engines]
+
+
+def replay(timeline: Timeline, scores=None, **kwargs):
+    ''' Replay kayfabe scores over timeline.
+
+        :param timeline:    Timeline to replay.
+        :param scores:      Starting scores as dict of wrestler nr -> score.
+                            Updated in place.
+        :param kwargs:      Scoring parameters, see :class:`KayfabeEngine`.
+
+        :return:            Tuple of (match_id, wrestler_nr, score, delta)
+                            arrays, in insertion order.
+    '''
+    return stream(timeline, [KayfabeEngine(scores, **kwargs)])[0]
+
+
+def partition(timeline: Timeline, parts):
+    ''' Split timeline into independent timelines.
+
+        Connected components are packed into at most ``parts`` timelines,
+        balanced by participant count.
+    '''
+    labels = timeline.components()
+    weights = np.bincount(labels, weights=np.diff(timeline.offsets) + 1)
+
+    bins = [(0, b) for b in range(parts)]
+    assign = np.empty(len(weights), dtype=np.int64)
+
+    # Largest first, ties by label to keep partitioning deterministic.
+    for c in np.argsort(-weights, kind='stable').tolist():
+        load, b = heapq.heappop(bins)
+        assign[c] = b
+        heapq.heappush(bins, (load + weights[c], b))
+
+    match_bin = assign[labels]
+    return [timeline.take(np.flatnonzero(match_bin == b))
+            for b in range(parts) if (match_bin == b).any()]
+
+
+def _stream_part(job):
+    ''' Process pool worker for :func:`stream_parallel`. '''
+    part, engines = job
+    stream(part, engines)
+    return engines
+
+
+def stream_parallel(timeline: Timeline, engines, processes=None):
+    ''' Feed independent partitions of timeline through rating engines in a
+        process pool.
+
+        Gives same result as :func:`stream`.
+
+        :param processes:   Worker count, defaults to CPU count.
+    '''
+    processes = processes or os.cpu_count()
+
+    parts = partition(timeline, processes) if len(timeline) else []
+    if len(parts) <= 1:
+        return stream(timeline, engines)
+
+    jobs = []
+    for part in parts:
+        nrs = np.unique(part.wrestler).tolist()
+        jobs.append((part, [engine.fork(nrs) for engine in engines]))
+
+    logger.debug('Replaying %d partitions in %d processes', len(parts), processes)
+
+    with ProcessPoolExecutor(processes) as pool:
+        results = list(pool.map(_stream_part, jobs))
+
+    rows = []
+    for (k, engine) in enumerate(engines):
+        for forks in results:
+            engine.ratings.update(forks[k].ratings)
+
+        columns = [np.concatenate(c) for c in zip(*(forks[k].rows() for forks in results))]
+
+        # Back into timeline order. Rows of match come from single partition, in order.
+        pos, _ = timeline.position(columns[0])
+        order = np.argsort(pos, kind='stable')
+
+        rows.append(tuple(c[order] for c in columns))
+
+    return rows
+
+
+def replay_parallel(timeline: Timeline, scores=None, processes=None, **kwargs):
+    ''' Replay kayfabe scores over timeline in a process pool.
+
+        Gives same result as :func:`replay`.
+    '''
+    return stream_parallel(timeline, [KayfabeEngine(scores, **kwargs)], processes)[0]
+
+
+def last_scores(before=None, wrestlers=None, session=session):
+    ''' Each wrestler's latest score, in replay order.
+
+        :param before:      Consider only matches before date.
+        :param wrestlers:   Limit to wrestler nrs.
+
+        :return:            List of (wrestler_nr, score, match_id, date).
+    '''
+    last = func.row_number().over(
+        partition_by=Score.wrestler_nr,
+        order_by=(desc(Match.date), asc(Match.id), desc(Score.id))
+    ).label('last')
+
+    q = session.query(Score.wrestler_nr, Score.score, Score.match_id, Match.date, last).join(Match)
+    if before is not None:
+        q = q.filter(Match.date < before)
+    if wrestlers is not None:
+        q = q.filter(Score.wrestler_nr.in_(wrestlers))
+    q = q.subquery()
+
+    return session.query(q.c.wrestler_nr, q.c.score, q.c.match_id, q.c.date).\
+        filter(q.c.last == 1).all()
+
+
+def checkpoint(before, session=session):
+    ''' Wrestler scores as they stood before date.
+
+        :return:            Dict of wrestler nr -> score.
+    '''
+    return {nr: score for (nr, score, _, _) in last_scores(before, session=session)}
+
+
+def scored_through(session=session):
+    ''' Highest match id scoring has processed, including matches that
+        gave no scores. Databases scored before watermark was kept fall back
+        to highest scored match id.
+    '''
+    watermark = session.query(Watermark.match_id).filter_by(name='scores').scalar()
+    if watermark is None:
+        watermark = session.query(func.max(Score.match_id)).scalar()
+    return watermark
+
+
+def mark_scored(match_id, session=session):
+    ''' Record matches up to id as processed by scoring. '''
+    session.merge(Watermark(name='scores', match_id=match_id))
+
+
+def unscored_since(session=session):
+    ''' Find matches added after last scoring.
+
+        :return:            Tuple of (earliest unscored match date, latest
+                            scored match date). Either is None if missing.
+    '''
+    last_processed = scored_through(session=session)
+
+    q = session.query(func.min(Match.date))
+    if last_processed is not None:
+        q = q.filter(Match.id > last_processed)
+    first_unscored = q.scalar()
+
+    last_date = session.query(func.max(Match.date)).join(Score).scalar()
+
+    return (first_unscored, last_date)
+
+
+def clear_scores(from_date=None, session=session):
+    ''' Delete scores of matches on and after date. '''
+    q = session.query(Score)
+    if from_date is not None:
+        q = q.filter(Score.match_id.in_(
+            session.query(Match.id).filter(Match.date >= from_date)
+        ))
+    return q.delete(synchronize_session=False)
+
+
+def write_scores(rows, session=session, batch_size=50000, model=Score, columns=KayfabeEngine.columns):
+    ''' Bulk insert score rows, as returned by :func:`replay`.
+
+        :param model:       Score table model.
+        :param columns:     Column names of rows.
+    '''
+    rows = list(zip(*(a.tolist() for a in rows)))
+    bulk_insert(model.__table__, columns, rows, session=session, batch_size=batch_size)
+
+    logger.debug('Wrote %d scores into %s', len(rows), model.__tablename__)
+
+
+def replayed_scores(timeline: Timeline, rows):
+    ''' Latest score of each wrestler in replayed rows.
+
+        :return:            List of (wrestler_nr, score, match_id, date).
+    '''
+    match_id, wrestler_nr, score = rows[:3]
+
+    # Last occurrence of each wrestler is first one in reversed rows.
+    nrs, idx = np.unique(wrestler_nr[::-1], return_index=True)
+    idx = len(wrestler_nr) - 1 - idx
+
+    pos, _ = timeline.position(match_id[idx])
+    dates = timeline.date[pos].astype(object)
+
+    return list(zip(nrs.tolist(), score[idx].tolist(), match_id[idx].tolist(), dates))
+
+
+def store_current_scores(scores, session=session, batch_size=50000):
+    ''' Insert or replace current score rows.
+
+        :param scores:      Iterable of (wrestler_nr, score, match_id, date).
+    '''
+    scores = [
+        {'wrestler_nr': nr, 'score': score, 'last_match_id': match_id, 'last_date': date}
+        for (nr, score, match_id, date) in scores
+    ]
+
+    insert = CurrentScore.__table__.insert().prefix_with('OR REPLACE')
+    for start in range(0, len(scores), batch_size):
+        session.execute(insert, scores[start:start+batch_size])
+
+
+def update_current_scores(timeline: Timeline, rows, from_date=None, session=session):
+    ''' Bring current score table up to date after replaying timeline.
+
+        :param from_date:   Date replay started from, None if full replay.
+    '''
+    current = replayed_scores(timeline, rows)
+
+    q = session.query(CurrentScore)
+    if from_date is not None:
+        q = q.filter(CurrentScore.last_date >= from_date)
+    replayed = set(nr for (nr, _, _, _) in current)
+    stale = [nr for (nr,) in q.with_entities(CurrentScore.wrestler_nr).all() if nr not in replayed]
+    q.delete(synchronize_session=False)
+
+    if stale and from_date is not None:
+        ''' Replayed timeline no longer has their latest score. '''
+        current = current + last_scores(from_date, stale, session=session)
+
+    store_current_scores(current, session=session)
+
+
+def fill_score_deltas(session=session, batch_size=50000):
+    ''' Compute missing score deltas from previous score of each wrestler,
+        in replay order.
+    '''
+    rows = session.query(Score.id, Score.wrestler_nr, Score.score).join(Match).\
+        order_by(Score.wrestler_nr, asc(Match.date), desc(Match.id), asc(Score.id)).all()
+    if not rows:
+        return
+
+    score_id = np.array([r[0] for r in rows], dtype=np.int64)
+    wrestler_nr = np.array([r[1] for r in rows], dtype=np.int64)
+    score = np.array([r[2] for r in rows], dtype=np.int64)
+
+    before = np.empty_like(score)
+    before[0] = BASE_SCORE
+    before[1:] = score[:-1]
+    before[1:][wrestler_nr[1:] != wrestler_nr[:-1]] = BASE_SCORE
+
+    update = Score.__table__.update().where(Score.__table__.c.id == bindparam('score_id')).\
+        values(delta=bindparam('delta'))
+    deltas = [{'score_id': i, 'delta': d} for (i, d) in zip(score_id.tolist(), (score - before).tolist())]
+    for start in range(0, len(deltas), batch_size):
+        session.execute(update, deltas[start:start+batch_size])
+
+    logger.debug('Filled %d score deltas', len(deltas))
+
+
+def rebuild_current_scores(session=session):
+    ''' Rebuild current score table from scores table. '''
+    session.query(CurrentScore).delete(synchronize_session=False)
+    store_current_scores(last_scores(session=session), session=session)
@@ -4,10 +4,13 @@
 from kayfabe.models import *
 from . import session
 
-from sqlalchemy import asc, desc, func
+from sqlalchemy import and_, asc, case, desc, func, literal, or_, Date
+from sqlalchemy.orm import selectinload
 
 from datetime import date, timedelta
-from collections import Sequence
+from collections.abc import Sequence
+
+import numpy as np
 
 import logging
 
@@ -21,23 +24,45 @@ class Ranking(Sequence):
 
     limit           = 1000
 
+    # Default window length, before to_date.
+    window          = timedelta(days=90)
+
     rank            = None
     prev_rank       = None
 
     scores          = None
-    prev_scores     = None
 
     rank_idx        = {}
-    prev_rank_idx   = {}
-    
+
+    # nr -> (rank, score, previous rank, previous score), None outside window.
+    standings       = None
+
+    # Lazy mode fetches pages of ranking on demand.
+    lazy            = False
+    page_size       = 100
+
+    # Load promotions and gimmicks of ranked wrestlers in batch queries.
+    preload         = False
+
     _iterator       = 0
 
     def __init__(self, **kwargs):
         self.to_date = kwargs.get('to_date', date.today())
-        self.from_date = kwargs.get('from_date', self.to_date - timedelta(days=90) )
+        self.from_date = kwargs.get('from_date', self.to_date - self.window)
 
         self.limit = kwargs.get('limit', self.limit)
-        self.get_ranking()
+
+        self.lazy = kwargs.get('lazy', self.lazy)
+        self.page_size = kwargs.get('page_size', self.page_size)
+        self.preload = kwargs.get('preload', self.preload)
+
+        if self.lazy:
+            # Loaded pages as lists of (wrestler, rank, score).
+            self._pages = []
+            self._length = None
+            self._lookups = {}
+        else:
+            self.get_ranking()
 
     def next(self):
         if len(self.rank) >= self._iterator:
@@ -48,94 +73,314 @@ class Ranking(Sequence):
         return r
 
     def __getitem__(self, index):
+        if self.lazy:
+            return self._lazy_item(index)
         return self.rank[index]
 
     def __len__(self):
+        if self.lazy:
+            if self._length is None:
+                self._length = session.query(window_scores(self.from_date, self.to_date)).count()
+                if self.limit:
+                    self._length = min(self._length, self.limit)
+            return self._length
         return len(self.rank)
 
+    def _lazy_item(self, index):
+        if isinstance(index, slice):
+            return [self._lazy_item(i) for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or (self.limit and index >= self.limit):
+            raise IndexError(index)
+
+        page = index // self.page_size
+        while len(self._pages) <= page:
+            if not self._fetch_page():
+                raise IndexError(index)
+
+        rows = self._pages[page]
+        if index % self.page_size >= len(rows):
+            raise IndexError(index)
+
+        return rows[index % self.page_size][0]
+
+    def _fetch_page(self):
+        """Fetch next page, seeking past last loaded (score, wrestler_nr)."""
+        best = window_scores(self.from_date, self.to_date)
+
+        q = self._preload(session.query(Wrestler, best.c.score)).join(best, Wrestler.nr == best.c.wrestler_nr).\
+            order_by(desc(best.c.score), asc(best.c.wrestler_nr))
+
+        position = len(self._pages) * self.page_size
+        last = self._pages[-1][-1] if self._pages else None
+
+        if last:
+            (w, rank, score) = last
+            q = q.filter(or_(best.c.score < score, and_(best.c.score == score, best.c.wrestler_nr > w.nr)))
+
+        rows = []
+        for (i, (w, score)) in enumerate(q.limit(self.page_size).all()):
+            # RANK(): ties share rank of their first position.
+            if last and last[2] == score:
+                rank = last[1]
+            elif last is None:
+                rank = 1
+            else:
+                rank = position + i + 1
+
+            w.rank = rank
+            w.score = score
+
+            last = (w, rank, score)
+            rows.append(last)
+
+        if not rows:
+            return False
+
+        self._pages.append(rows)
+        return True
+
+    def _preload(self, q):
+        """Add batch loading of wrestler relations to query, if preloading."""
+        if self.preload:
+            q = q.options(selectinload(Wrestler.promotion), selectinload(Wrestler.gimmicks))
+        return q
+
+    def _lazy_standing(self, nr):
+        """Rank and score of single wrestler in both windows, from indexed lookups."""
+        if nr not in self._lookups:
+            standing = ()
+            for (from_date, to_date) in ((self.from_date, self.to_date), previous_period(self.from_date, self.to_date)):
+                best = window_scores(from_date, to_date)
+                score = session.query(best.c.score).filter(best.c.wrestler_nr == nr).scalar()
+
+                rank = None
+                if score is not None:
+                    rank = session.query(best).filter(best.c.score > score).count() + 1
+
+                standing += (rank, score)
+
+            self._lookups[nr] = standing
+
+        return self._lookups[nr]
+
     def get_ranking(self):
-        if not self.rank:
-            self.rank_idx, self.rank, self.scores = self.get_ranked_wrestlers(update=True)
+        if self.standings is None:
+            self.get_standings(update=True)
         return self.rank
 
     def get_previus_ranking(self):
-        if not self.prev_rank:
-            delta = self.to_date - self.from_date
-            date_from = self.to_date - delta
-            date_to = self.from_date
-            
-            self.prev_rank_idx, self.prev_rank, self.prev_scores = self.get_ranked_wrestlers(
-                from_date=date_from, to_date=date_to,  limit=False, update=False
-            )
-
+        if self.standings is None:
+            self.get_standings(update=True)
         return self.prev_rank
 
-    def get_ranked_wrestlers(self, to_date=None, from_date=None, limit=None, update=False):
-        """Get wrestler rankings."""
-        to_date = to_date if to_date else self.to_date
-        from_date = from_date if from_date else self.from_date 
-        limit = limit if limit else self.limit
+    def _both_windows(self):
+        """Best scores in current and previous window, as subquery of
+        (wrestler_nr, score, prev_score)."""
+        from_date, to_date = self.from_date, self.to_date
+        prev_from, prev_to = previous_period(from_date, to_date)
 
-        q = session.query(Score).order_by(desc(func.max(Score.score))).\
-            join(Match).filter(Match.date >= from_date).\
-            filter(Match.date <= to_date).\
-            join(Wrestler).group_by(Score.wrestler_nr)
+        if is_materialized(from_date, to_date) and is_materialized(prev_from, prev_to):
+            in_current = and_(*(getattr(RankingScore, k) == v for (k, v) in _window(from_date, to_date).items()))
+            in_previous = and_(*(getattr(RankingScore, k) == v for (k, v) in _window(prev_from, prev_to).items()))
 
-        logging.debug("Found %d ranked wrestler for %s - %s", q.count(), from_date, to_date)
+            best = session.query(
+                RankingScore.wrestler_nr.label('wrestler_nr'),
+                func.max(case([(in_current, RankingScore.score)])).label('score'),
+                func.max(case([(in_previous, RankingScore.score)])).label('prev_score')
+            ).filter(or_(in_current, in_previous)).group_by(RankingScore.wrestler_nr)
+        else:
+            in_current = Match.date >= from_date
+            best = session.query(
+                Score.wrestler_nr.label('wrestler_nr'),
+                func.max(case([(in_current, Score.score)])).label('score'),
+                func.max(case([(~in_current, Score.score)])).label('prev_score')
+            ).join(Match).filter(Match.date >= prev_from).filter(Match.date <= to_date).\
+                join(Wrestler).group_by(Score.wrestler_nr)
 
-        if limit:
-            q = q.slice(0,limit)
+        return best.subquery()
 
-        idx = {}
-        r = []
-        scores = []
+    def get_standings(self, update=False):
+        """Rank current and previous window in single statement.
 
-        for (i, w) in enumerate(q.all()):
-            if update:
-                w.wrestler.rank = i + 1
-                w.wrestler.score = w.score
+        Previous window is of same length, ending day before current window.
+        Read from rankings table if both windows are materialized, aggregated
+        from scores otherwise.
+        """
+        from_date, to_date = self.from_date, self.to_date
+        prev_from, prev_to = previous_period(from_date, to_date)
 
-            r.append(w.wrestler)
-            scores.append(w)
+        best = self._both_windows()
 
-            idx[w.wrestler.nr] = i
+        q = self._preload(session.query(
+            Wrestler, best.c.score, best.c.prev_score,
+            func.rank().over(order_by=desc(best.c.score)),
+            func.rank().over(order_by=desc(best.c.prev_score))
+        )).join(best, Wrestler.nr == best.c.wrestler_nr).\
+            order_by(desc(best.c.score), asc(best.c.wrestler_nr))
 
-        return (idx, r, scores)
+        self.standings = {}
+        self.rank = []
+        self.scores = []
+        self.rank_idx = {}
 
-    def get_rank(self, nr):
-        self.get_ranking()
-        nr = self._get_nr(nr)
+        previous = []
 
-        if nr in self.rank_idx:
-            return self.rank_idx[nr]+1
+        for (w, score, prev_score, rank, prev_rank) in q.all():
+            rank = rank if score is not None else None
+            prev_rank = prev_rank if prev_score is not None else None
 
-        return None
+            self.standings[w.nr] = (rank, score, prev_rank, prev_score)
 
-    def get_previous_rank(self, nr):
-        self.get_previus_ranking()
-        nr = self._get_nr(nr)
+            if rank is not None and (not self.limit or len(self.rank) < self.limit):
+                if update:
+                    w.rank = rank
+                    w.score = score
 
-        if nr in self.prev_rank_idx:
-            return self.prev_rank_idx[nr]+1
+                self.rank_idx[w.nr] = len(self.rank)
+                self.rank.append(w)
+                self.scores.append(score)
 
-        return None
+            if prev_rank is not None:
+                previous.append((prev_rank, w.nr, w))
 
-    def get_score(self, nr):
-        self.get_ranking()
+        self.prev_rank = [w for (_, _, w) in sorted(previous, key=lambda p: p[:2])]
+
+        logging.debug("Found %d ranked wrestler for %s - %s, %d for %s - %s", len(self.rank), from_date, to_date,
+                      len(self.prev_rank), prev_from, prev_to)
+
+        return self.standings
+
+    def _standing(self, nr, field):
         nr = self._get_nr(nr)
 
-        if nr in self.rank_idx:
-            return self.scores[self.rank_idx[nr]].score
+        if self.lazy:
+            return self._lazy_standing(nr)[field]
+
+        self.get_ranking()
+
+        if nr in self.standings:
+            return self.standings[nr][field]
 
         return None
 
-    def get_previous_score(self, nr):
-        self.get_previus_ranking()
-        nr = self._get_nr(nr)
+    def get_rank(self, nr):
+        return self._standing(nr, 0)
 
-        if nr in self.rank_idx:
-            score = self.prev_scores[self.prev_rank_idx[nr]].score
-            return score
+    def get_previous_rank(self, nr):
+        return self._standing(nr, 2)
+
+    def get_score(self, nr):
+        return self._standing(nr, 1)
+
+    def get_previous_score(self, nr):
+        return self._standing(nr, 3)
+
+    def get_rank_delta(self, nr):
+        """Ranks risen since previous window, None if unranked in either."""
+        rank, prev_rank = self.get_rank(nr), self.get_previous_rank(nr)
+        if rank is None or prev_rank is None:
+            return None
+        return prev_rank - rank
+
+    def get_score_delta(self, nr):
+        """Score change since previous window, None if unranked in either."""
+        score, prev_score = self.get_score(nr), self.get_previous_score(nr)
+        if score is None or prev_score is None:
+            return None
+        return score - prev_score
+
+    def movers(self, n=1):
+        """Biggest movers between previous and current window, among all
+        wrestlers ranked in both.
+
+        Ties are broken by current ranking order.
+
+        :param n:       Count of wrestlers in each list.
+
+        :return:        Dict of 'rank_risers' by ranks risen, 'score_risers'
+                        by relative score rise, and 'droppers' by ranks
+                        dropped, as lists of wrestlers. Lists are empty
+                        when nobody moved that way.
+        """
+        if self.standings is not None:
+            rows = [(nr,) + standing for (nr, standing) in self.standings.items()]
+        else:
+            best = self._both_windows()
+
+            # Ranked over whole windows, before filtering.
+            ranked = session.query(
+                best.c.wrestler_nr,
+                func.rank().over(order_by=desc(best.c.score)).label('rank'), best.c.score,
+                func.rank().over(order_by=desc(best.c.prev_score)).label('prev_rank'), best.c.prev_score
+            ).subquery()
+
+            rows = session.query(ranked).\
+                filter(ranked.c.score != None).filter(ranked.c.prev_score != None).all()
+
+        rows = [r for r in rows if r[2] is not None and r[4] is not None]
+        if not rows:
+            return {'rank_risers': [], 'score_risers': [], 'droppers': []}
+
+        nr, rank, score, prev_rank, prev_score = (np.array(c) for c in zip(*rows))
+
+        rank_delta = prev_rank - rank
+        score_ratio = score / prev_score
+
+        # Current ranking order: rank, then wrestler nr. Only wrestlers who
+        # actually moved that way qualify.
+        movers = {}
+        for (key, moved, by) in (('rank_risers', rank_delta > 0, -rank_delta),
+                                 ('score_risers', score_ratio > 1, -score_ratio),
+                                 ('droppers', rank_delta < 0, rank_delta)):
+            order = np.lexsort((nr, rank, by))
+            movers[key] = order[moved[order]][:n]
+
+        nrs = set(nr[np.concatenate(list(movers.values()))].tolist())
+        wrestlers = {w.nr: w for w in self._preload(session.query(Wrestler)).filter(Wrestler.nr.in_(nrs))}
+
+        for (key, idx) in movers.items():
+            movers[key] = [wrestlers[i] for i in nr[idx].tolist()]
+
+        return movers
+
+    def leaderboards(self, k=10, promotions=None):
+        """Top wrestlers of each promotion in current window, in single query.
+
+        Window aggregate is partitioned by wrestler's promotion, ranked with
+        window functions, and cut to k per promotion.
+
+        :param k:           Wrestlers per promotion.
+        :param promotions:  Limit to promotion ids, such as keys of
+                            kayfabe.events.
+
+        :return:            Dict of promotion id -> list of (wrestler,
+                            rank in promotion, score).
+        """
+        best = window_scores(self.from_date, self.to_date)
+
+        in_promotion = dict(partition_by=Wrestler.promotion_id, order_by=desc(best.c.score))
+        ranked = session.query(
+            best.c.wrestler_nr, best.c.score,
+            func.rank().over(**in_promotion).label('rank'),
+            func.row_number().over(partition_by=Wrestler.promotion_id,
+                                   order_by=(desc(best.c.score), asc(best.c.wrestler_nr))).label('place')
+        ).join(Wrestler, Wrestler.nr == best.c.wrestler_nr)
+        if promotions is not None:
+            ranked = ranked.filter(Wrestler.promotion_id.in_(list(promotions)))
+        ranked = ranked.subquery()
+
+        q = self._preload(session.query(Wrestler, ranked.c.rank, ranked.c.score)).\
+            join(ranked, Wrestler.nr == ranked.c.wrestler_nr).filter(ranked.c.place <= k).\
+            order_by(Wrestler.promotion_id, ranked.c.place)
+
+        boards = {}
+        for (w, rank, score) in q.all():
+            boards.setdefault(w.promotion_id, []).append((w, rank, score))
+
+        return boards
 
     def _get_nr(self, nr):
 
@@ -146,4 +391,119 @@ class Ranking(Sequence):
         return nr
 
 
+def ranking_period(to_date=None):
+    """Ranking period of site, RANK_TIME months back from start of month."""
+    to_date = to_date if to_date else date.today()
+    return (date(to_date.year, to_date.month, 1) - RANK_TIME * timedelta(days=30), to_date)
+
+
+def previous_period(from_date, to_date):
+    """Window of same length as given, ending day before it."""
+    prev_to = from_date - timedelta(days=1)
+    return (prev_to - (to_date - from_date), prev_to)
+
+
+def _window(from_date, to_date):
+    return {'window_end': to_date, 'window_length': (to_date - from_date).days}
+
+
+def is_materialized(from_date, to_date, session=session):
+    """Check if ranking window is in rankings table."""
+    return session.query(
+        session.query(RankingScore).filter_by(**_window(from_date, to_date)).exists()
+    ).scalar()
+
+
+def window_scores(from_date, to_date, session=session):
+    """Best score of wrestlers within window, as subquery of (wrestler_nr, score).
+
+    Read from rankings table if window is materialized.
+    """
+    if is_materialized(from_date, to_date, session=session):
+        q = session.query(RankingScore.wrestler_nr.label('wrestler_nr'), RankingScore.score.label('score')).\
+            filter_by(**_window(from_date, to_date))
+    else:
+        q = session.query(Score.wrestler_nr.label('wrestler_nr'), func.max(Score.score).label('score')).\
+            join(Match).filter(Match.date >= from_date).filter(Match.date <= to_date).\
+            join(Wrestler).group_by(Score.wrestler_nr)
+
+    return q.subquery()
+
+
+def materialize_window(from_date, to_date, session=session):
+    """(Re)compute ranking window into rankings table, in single statement."""
+    window = _window(from_date, to_date)
+    session.query(RankingScore).filter_by(**window).delete(synchronize_session=False)
+
+    best = session.query(
+        literal(window['window_end'], Date), literal(window['window_length']),
+        Score.wrestler_nr, func.max(Score.score)
+    ).join(Match).filter(Match.date >= from_date).filter(Match.date <= to_date).\
+        join(Wrestler).group_by(Score.wrestler_nr)
+
+    session.execute(RankingScore.__table__.insert().from_select(
+        ['window_end', 'window_length', 'wrestler_nr', 'score'], best
+    ))
+
+
+def ensure_window(from_date, to_date, session=session):
+    """Materialize ranking window unless already done."""
+    if not is_materialized(from_date, to_date, session=session):
+        materialize_window(from_date, to_date, session=session)
+
+
+def materialized_windows(from_date=None, session=session):
+    """Materialized windows ending on or after date, as (from_date, to_date)."""
+    q = session.query(RankingScore.window_end, RankingScore.window_length).distinct()
+    if from_date is not None:
+        q = q.filter(RankingScore.window_end >= from_date)
+    return [(end - timedelta(days=length), end) for (end, length) in q.all()]
+
+
+def prune_windows(keep, session=session):
+    """Delete materialized windows other than keep, list of (from_date, to_date).
+
+    :return:    Count of deleted ranking rows.
+    """
+    q = session.query(RankingScore)
+    for window in (_window(*period) for period in keep):
+        q = q.filter(~and_(RankingScore.window_end == window['window_end'],
+                           RankingScore.window_length == window['window_length']))
+    return q.delete(synchronize_session=False)
+
+
+def refresh_windows(from_date=None, session=session):
+    """Recompute materialized windows affected by rescoring on and after date."""
+    for (start, end) in materialized_windows(from_date, session=session):
+        materialize_window(start, end, session=session)
+
+
+def update_windows(after_match_id, session=session):
+    """Fold scores of matches appended after match id into materialized windows.
+
+    Appended scores can only raise wrestler's best score in window, so only
+    wrestlers with new scores are touched.
+    """
+    new = session.query(Match.date, Score.wrestler_nr, func.max(Score.score)).\
+        join(Score).join(Wrestler).filter(Match.id > after_match_id).\
+        group_by(Match.date, Score.wrestler_nr).order_by(Match.date).all()
+
+    if not new:
+        return
+
+    for (start, end) in materialized_windows(new[0][0], session=session):
+        best = {}
+        for (match_date, nr, score) in new:
+            if start <= match_date <= end:
+                best[nr] = max(score, best.get(nr, score))
+
+        window = _window(start, end)
+        current = session.query(RankingScore.wrestler_nr, RankingScore.score).filter_by(**window).\
+            filter(RankingScore.wrestler_nr.in_(list(best)))
+        for (nr, score) in current.all():
+            best[nr] = max(score, best[nr])
 
+        if best:
+            session.execute(RankingScore.__table__.insert().prefix_with('OR REPLACE'), [
+                dict(window, wrestler_nr=nr, score=score) for (nr, score) in best.items()
+            ])
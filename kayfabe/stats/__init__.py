@@ -1,48 +1,101 @@
 from kayfabe.models import *
 from kayfabe import session
 
-import operator
+from sqlalchemy import case, desc, func
 
-def get_biggest_cheater(from_date, to_date) -> Wrestler:
-    print(from_date, to_date)
-    """ Fetch biggest DQ loser. """
-    # Note: case sensitive
-    resolutions = ['DQ', 'Count Out']
+import pandas as pd
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Match resolutions counted as cheating. Note: case sensitive
+CHEAT_RESOLUTIONS = ('DQ', 'Count Out')
+
+
+def get_cheaters(from_date, to_date, limit=10, resolutions=CHEAT_RESOLUTIONS):
+    """ Wrestlers losing most matches by DQ or count out within window.
+
+        Losers we don't track are left out by join.
+
+        :return:    List of (wrestler, count), most losses first. Empty if
+                    nobody lost that way.
+    """
+    losses = func.count(MatchWrestler.id).label('losses')
 
-    q = session.query(MatchWrestler).filter(MatchWrestler.resolution==MatchWrestler.LOSER).\
+    q = session.query(MatchWrestler.wrestler_id, losses).\
+        filter(MatchWrestler.resolution == MatchWrestler.LOSER).\
         join(Match).filter(Match.date >= from_date).filter(Match.date <= to_date).\
-        filter(Match.resolution.in_(resolutions))
-
-    counts = {}
-
-    for match in q.all():
-        try:
-            wrestler = match.wrestler.nr
-            ended = match.match.resolution
-            if ended == None:
-                continue
-            counts.setdefault(wrestler, 0)
-            counts[wrestler] += 1
-        except AttributeError:
-            # Participiant we dont track, ignore.
-            pass
-
-    s = sorted(counts.items(), key=operator.itemgetter(1), reverse=True)
-    nr = s[0][0]
-    return session.query(Wrestler).get(nr)
+        filter(Match.resolution.in_(resolutions)).\
+        group_by(MatchWrestler.wrestler_id).subquery()
 
-def match_ending_stats(wrestler: Wrestler, from_date, to_date):
-    stats = {}
-    q = session.query(MatchWrestler).filter(MatchWrestler.wrestler_id==wrestler.nr).join(Match).\
-        filter(Match.date >= from_date).filter(Match.date <= to_date)
+    q = session.query(Wrestler, q.c.losses).join(q, q.c.wrestler_id == Wrestler.nr).\
+        order_by(desc(q.c.losses), Wrestler.nr)
+    if limit is not None:
+        q = q.limit(limit)
+
+    return q.all()
+
+
+def get_biggest_cheater(from_date, to_date) -> Wrestler:
+    """ Fetch biggest DQ loser, None if there is none. """
+    cheaters = get_cheaters(from_date, to_date, limit=1)
+    return cheaters[0][0] if cheaters else None
+
+
+# Match ending count matrices by window, see match_ending_matrix().
+_ending_stats = {}
 
-    for match in q.all():
-        ended = match.match.resolution
-        if not ended:
-            ended = match.resolution
-        stats.setdefault(ended, 0)
-        stats[ended] += 1
 
-    print(stats)
-    return stats
+def match_ending_matrix(wrestlers, from_date, to_date) -> pd.DataFrame:
+    """ Count how matches of wrestlers ended within window.
+
+        Match resolution is used when known, otherwise the wrestler's own
+        win/loss resolution, as in match_ending_stats(). Counts are cached
+        by window, and only wrestlers not seen before are queried.
+
+        :param wrestlers:   Wrestlers or wrestler nrs.
+
+        :return:    DataFrame of counts, indexed by wrestler nr, with a
+                    column per resolution.
+    """
+    nrs = [getattr(w, 'nr', w) for w in wrestlers]
+    window = (from_date, to_date)
+
+    cached = _ending_stats.get(window)
+    missing = list(dict.fromkeys(nrs if cached is None else [nr for nr in nrs if nr not in cached.index]))
+
+    if missing or cached is None:
+        ending = case([(func.coalesce(Match.resolution, '') != '', Match.resolution)],
+                      else_=MatchWrestler.resolution)
+
+        q = session.query(MatchWrestler.wrestler_id, ending, func.count(MatchWrestler.id)).\
+            filter(MatchWrestler.wrestler_id.in_(missing)).\
+            join(Match).filter(Match.date >= from_date).filter(Match.date <= to_date).\
+            group_by(MatchWrestler.wrestler_id, ending)
+
+        counts = pd.DataFrame(q.all(), columns=['wrestler_nr', 'resolution', 'count']).\
+            pivot(index='wrestler_nr', columns='resolution', values='count').\
+            reindex(missing)
+
+        cached = counts if cached is None else pd.concat([cached, counts])
+        cached = _ending_stats[window] = cached.fillna(0).astype(int)
+        cached.columns.name = 'resolution'
+
+        logger.debug('Counted match endings of %d wrestlers', len(missing))
+
+    return cached.reindex(nrs, fill_value=0)
+
+
+def clear_stats_cache():
+    """ Forget cached match ending counts, after matches change. """
+    _ending_stats.clear()
+
+
+def match_ending_stats(wrestler: Wrestler, from_date, to_date):
+    """ Count how matches of wrestler ended within window.
 
+        :return:    Dict of resolution: count.
+    """
+    row = match_ending_matrix([wrestler], from_date, to_date).iloc[0]
+    return {ended: int(count) for (ended, count) in row.items() if count}
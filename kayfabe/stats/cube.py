@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    Statistics cube of match counts.
+
+    Matches are counted by (promotion, month, event type, resolution, title
+    change) into stats_cube table. Match is counted once, for its first
+    listed promotion, so roll-ups over promotions add up to match counts.
+
+    Cube is updated incrementally with update_cube() after matches are
+    inserted, and most statistics are a roll-up of it::
+
+        # DQ rate per promotion
+        counts = rollup(['promotion_id', 'resolution'])['matches'].unstack(fill_value=0)
+        rates = counts['DQ'] / counts.sum(axis=1)
+
+        # Pay per view share of matches in 2020
+        counts = rollup(['event_type'], from_date=date(2020, 1, 1), to_date=date(2020, 12, 31))
+'''
+
+import logging
+
+from datetime import date
+
+import pandas as pd
+
+from sqlalchemy import exists, func
+from sqlalchemy.dialects.sqlite import insert
+
+from kayfabe.models import Match, MatchPromotion, MatchTitle, StatsCell
+from kayfabe import session
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = ('promotion_id', 'month', 'event_type', 'resolution', 'title_change')
+
+
+def update_cube(session=session):
+    ''' Count matches inserted after last update into cube.
+
+        :return:            Count of counted matches.
+    '''
+    last = session.query(func.max(StatsCell.last_match_id)).scalar() or 0
+
+    first_promotion = session.query(MatchPromotion.match_id, func.min(MatchPromotion.id).label('id')).\
+        filter(MatchPromotion.match_id > last).group_by(MatchPromotion.match_id).subquery()
+    promotion = session.query(MatchPromotion.match_id, MatchPromotion.promotion_id).\
+        join(first_promotion, first_promotion.c.id == MatchPromotion.id).subquery()
+
+    cell = (
+        func.coalesce(promotion.c.promotion_id, 0),
+        func.strftime('%Y-%m-01', Match.date),
+        func.coalesce(Match.type, ''),
+        func.coalesce(Match.resolution, ''),
+        exists().where(MatchTitle.match_id == Match.id).where(MatchTitle.change == True)
+    )
+
+    q = session.query(*cell, func.count(Match.id), func.max(Match.id)).\
+        outerjoin(promotion, promotion.c.match_id == Match.id).\
+        filter(Match.id > last).filter(Match.date != None).\
+        group_by(*cell)
+
+    rows = []
+    for row in q.all():
+        (year, month, _) = (int(part) for part in row[1].split('-'))
+        rows.append(dict(zip(DIMENSIONS + ('matches', 'last_match_id'),
+                             (row[0], date(year, month, 1), row[2], row[3], bool(row[4]), row[5], row[6]))))
+
+    if rows:
+        upsert = insert(StatsCell.__table__)
+        upsert = upsert.on_conflict_do_update(index_elements=DIMENSIONS, set_={
+            'matches': StatsCell.matches + upsert.excluded.matches,
+            'last_match_id': func.max(StatsCell.last_match_id, upsert.excluded.last_match_id)
+        })
+        session.execute(upsert, rows)
+
+    count = sum(row['matches'] for row in rows)
+    logger.debug('Counted %d matches into %d cube cells', count, len(rows))
+
+    return count
+
+
+def rebuild_cube(session=session):
+    ''' Recount cube from all matches. '''
+    session.query(StatsCell).delete(synchronize_session=False)
+    return update_cube(session=session)
+
+
+def rollup(by=(), from_date=None, to_date=None, session=session, **where):
+    ''' Match counts of cube slice, rolled up to dimensions.
+
+        :param by:          Dimensions to keep, others are summed over.
+        :param from_date:   Only months on and after month of date.
+        :param to_date:     Only months on and before date.
+        :param where:       Dimension values to slice by, value or list of
+                            values.
+
+        :return:            DataFrame of match counts, indexed by dimensions
+                            in by.
+    '''
+    by = list(by)
+    for dimension in by + list(where):
+        if dimension not in DIMENSIONS:
+            raise ValueError('Unknown cube dimension %s' % dimension)
+
+    columns = [getattr(StatsCell, dimension) for dimension in by]
+    q = session.query(*columns, func.sum(StatsCell.matches)).group_by(*columns)
+
+    for (dimension, value) in where.items():
+        column = getattr(StatsCell, dimension)
+        if isinstance(value, (list, tuple, set, frozenset)):
+            q = q.filter(column.in_(value))
+        else:
+            q = q.filter(column == value)
+
+    if from_date is not None:
+        q = q.filter(StatsCell.month >= from_date.replace(day=1))
+    if to_date is not None:
+        q = q.filter(StatsCell.month <= to_date)
+
+    counts = pd.DataFrame(q.all(), columns=by + ['matches'])
+    counts['matches'] = counts['matches'].fillna(0).astype(int)
+
+    return counts.set_index(by) if by else counts
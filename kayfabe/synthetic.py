@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    Synthetic cagematch data, for benchmarking without real database.
+'''
+
+import logging
+
+from collections import defaultdict
+from datetime import date, timedelta
+from html import escape
+
+import numpy as np
+
+from . import session
+from .models import Base, Gimmick, Match, MatchEvent, MatchPromotion, MatchTitle, \
+    MatchWrestler, Promotion, Wrestler
+from .util import bulk_insert
+
+logger = logging.getLogger(__name__)
+
+# Wrestlers over this have no cagematch page.
+JOBBER_NR = 1000000
+
+EVENT_TYPES = {
+    'TV-Show': 0.45,
+    'House Show': 0.25,
+    'Event': 0.14,
+    'Pay Per View': 0.08,
+    'Dark Match': 0.08
+}
+
+RESOLUTIONS = {
+    None: 0.2,
+    'Pinfall': 0.52,
+    'Submission': 0.15,
+    'DQ': 0.06,
+    'Count Out': 0.03,
+    'No Contest': 0.04
+}
+
+# Match kinds as (description, winners, losers, probability).
+MATCH_KINDS = [
+    ('Singles Match', 1, 1, 0.64),
+    ('Tag Team Match', 2, 2, 0.2),
+    ('Triple Threat Match', 1, 2, 0.05),
+    ('Fatal Four Way Match', 1, 3, 0.04),
+    ('Six Man Tag Team Match', 3, 3, 0.04),
+    ('Gauntlet Match', 1, 7, 0.025),
+    ('Royal Rumble Match', 1, 29, 0.005),
+]
+
+MATCHES_PER_EVENT = 6
+
+# Share of matches fought in wrestler's own promotion.
+HOME_PROMOTION = 0.9
+
+# Share of losers who are jobbers without cagematch page.
+JOBBERS = 0.05
+
+TITLE_MATCHES = 0.12
+TITLE_CHANGES = 0.25
+TITLES_PER_PROMOTION = 3
+
+
+def _choice(rng, distribution, size):
+    ''' Draw keys of {key: probability} distribution. '''
+    keys = list(distribution)
+    p = np.array([distribution[k] for k in keys], dtype=np.float64)
+    return [keys[i] for i in rng.choice(len(keys), size=size, p=p / p.sum())]
+
+
+def generate(wrestlers=1000, matches=50000, promotions=20, seed=0, start=None, end=None, session=session):
+    ''' Fill empty database with synthetic wrestlers and matches.
+
+        Promotion sizes follow Zipf-like distribution, promotions 1 and 7
+        being largest as WWE and NJPW are in :mod:`kayfabe.events`.
+
+        :param start:       First match date. Defaults to 20 years before end.
+        :param end:         Last match date. Defaults to today, so that
+                            rankings of :mod:`kayfabe.scoring` are populated.
+
+        :return:            Dict of generated row counts.
+    '''
+    end = end or date.today()
+    start = start or end - timedelta(days=20 * 365)
+
+    rng = np.random.default_rng(seed)
+    bind = session.get_bind()
+    Base.metadata.create_all(bind)
+
+    weights = 1 / np.arange(1, promotions + 1) ** 1.1
+    weights = weights / weights.sum()
+    # Promotion 1 largest, promotion 7 second.
+    order = [1, 7] + [p for p in range(2, promotions + 1) if p != 7]
+    promotion_ids = np.array(order[:promotions])
+
+    bulk_insert(Promotion.__table__, ('cm_id', 'name', 'abbrevation'), [
+        (int(p), 'Promotion {p}'.format(p=p), 'P{p}'.format(p=p)) for p in promotion_ids
+    ], session=session)
+
+    nrs = np.arange(1, wrestlers + 1)
+    home = rng.choice(promotion_ids, size=wrestlers, p=weights)
+
+    bulk_insert(Wrestler.__table__, ('nr', 'name', 'promotion_id'), [
+        (int(nr), 'Wrestler {nr}'.format(nr=nr), int(p)) for nr, p in zip(nrs, home)
+    ], session=session)
+
+    gimmicks = []
+    for nr in nrs.tolist():
+        gimmicks.append((nr, 'Wrestler {nr}'.format(nr=nr), True))
+        for k in range(rng.integers(0, 3)):
+            gimmicks.append((nr, 'Gimmick {nr}-{k}'.format(nr=nr, k=k), False))
+    bulk_insert(Gimmick.__table__, ('wrestler_nr', 'gimmick', 'primary'), gimmicks, session=session)
+
+    rosters = {p: nrs[home == p] for p in promotion_ids.tolist()}
+    rosters = {p: r if len(r) >= 2 else nrs for p, r in rosters.items()}
+
+    # Events
+    events = max(1, matches // MATCHES_PER_EVENT)
+    days = (end - start).days + 1
+    event_date = np.sort(rng.integers(0, days, size=events))
+    event_promotion = rng.choice(promotion_ids, size=events, p=weights)
+    event_type = _choice(rng, EVENT_TYPES, events)
+
+    event_rows = []
+    for e in range(events):
+        d = start + timedelta(days=int(event_date[e]))
+        name = 'P{p} {type} {e} @ City {city}, Country'.format(
+            p=event_promotion[e], type=event_type[e], e=e + 1, city=e % 97)
+        event_rows.append((e + 1, name, d))
+    bulk_insert(MatchEvent.__table__, ('id', 'name', 'date'), event_rows, session=session)
+
+    # Matches
+    match_event = np.sort(rng.integers(0, events, size=matches))
+    kinds = rng.choice(len(MATCH_KINDS), size=matches, p=[k[3] for k in MATCH_KINDS])
+    resolutions = _choice(rng, RESOLUTIONS, matches)
+
+    match_rows = []
+    wrestler_rows = []
+    promotion_rows = []
+    title_rows = []
+
+    jobber = JOBBER_NR
+
+    for m in range(matches):
+        match_id = m + 1
+        e = int(match_event[m])
+        p = int(event_promotion[e])
+        desc, winner_count, loser_count, _ = MATCH_KINDS[kinds[m]]
+
+        title = None
+        if rng.random() < TITLE_MATCHES:
+            title = p * 100 + int(rng.integers(0, TITLES_PER_PROMOTION))
+            desc = 'Title {t} {desc}'.format(t=title, desc=desc)
+            title_rows.append((match_id, title, bool(rng.random() < TITLE_CHANGES)))
+
+        match_rows.append((match_id, e + 1, event_rows[e][1], event_type[e], event_rows[e][2],
+                           desc, resolutions[m]))
+        promotion_rows.append((match_id, p))
+
+        roster = rosters[p] if rng.random() < HOME_PROMOTION else nrs
+        count = min(winner_count + loser_count, len(roster))
+        participants = rng.choice(roster, size=count, replace=False).tolist()
+
+        nc = resolutions[m] == 'No Contest'
+        for k, nr in enumerate(participants):
+            if k < winner_count:
+                resolution = MatchWrestler.NC if nc else MatchWrestler.WINNER
+            else:
+                resolution = MatchWrestler.NC if nc else MatchWrestler.LOSER
+                if rng.random() < JOBBERS:
+                    jobber += 1
+                    nr = jobber
+            wrestler_rows.append((match_id, nr, resolution))
+
+    bulk_insert(Match.__table__, ('id', 'event_id', 'event_name', 'type', 'date', 'type_desc', 'resolution'),
+                match_rows, session=session)
+    bulk_insert(MatchWrestler.__table__, ('match_id', 'wrestler_id', 'resolution'), wrestler_rows, session=session)
+    bulk_insert(MatchPromotion.__table__, ('match_id', 'promotion_id'), promotion_rows, session=session)
+    bulk_insert(MatchTitle.__table__, ('match_id', 'title_id', 'change'), title_rows, session=session)
+
+    session.commit()
+
+    counts = {
+        'promotions': promotions,
+        'wrestlers': wrestlers,
+        'gimmicks': len(gimmicks),
+        'events': events,
+        'matches': matches,
+        'participants': len(wrestler_rows),
+        'titles': len(title_rows)
+    }
+    logger.debug('Generated %s', counts)
+
+    return counts
+
+
+def _page(rows):
+    return '''<html><body><div class="TableContents"><table>
+<tr class="THeaderRow"><td>#</td><td>Date</td><td>Promotion</td><td>Match</td><td>Type</td></tr>
+{rows}
+</table></div></body></html>'''.format(rows='\n'.join(rows))
+
+
+def _link(nr, name):
+    return '<a href="?id=2&amp;nr={nr}&amp;name={q}">{name}</a>'.format(
+        nr=nr, q=escape(name.replace(' ', '+')), name=escape(name))
+
+
+def write_match_pages(path_format, wrestler_nrs, session=session):
+    ''' Write cagematch style match list pages of wrestlers, for
+        scrape-matches.util.py to parse from its cache.
+
+        :param path_format: Page file name, formatted with wrestler and offset.
+        :param wrestler_nrs: Wrestlers to write pages for.
+
+        :return:            Written page files.
+    '''
+    names = dict(session.query(Wrestler.nr, Wrestler.name).all())
+    files = []
+
+    for wrestler_nr in wrestler_nrs:
+        matches = session.query(Match).join(MatchWrestler).\
+            filter(MatchWrestler.wrestler_id == wrestler_nr).\
+            order_by(Match.date.desc(), Match.id).all()
+
+        rows = []
+        for (i, match) in enumerate(matches):
+            sides = defaultdict(list)
+            for w in match.wrestlers:
+                name = names.get(w.wrestler_id, 'Jobber {nr}'.format(nr=w.wrestler_id))
+                sides[w.resolution].append(_link(w.wrestler_id, name))
+
+            if match.resolution == 'No Contest':
+                card = '{a} vs. {b} - No Contest'.format(
+                    a=' &amp; '.join(sides[MatchWrestler.NC][:1]),
+                    b=' &amp; '.join(sides[MatchWrestler.NC][1:]))
+            else:
+                card = '{w} defeats {l}'.format(
+                    w=' &amp; '.join(sides[MatchWrestler.WINNER]),
+                    l=' &amp; '.join(sides[MatchWrestler.LOSER]))
+                if match.resolution:
+                    card += ' by {by}'.format(by=escape(match.resolution))
+
+            match_type = escape(match.type_desc)
+            change = ''
+            for title in match.titles:
+                match_type = '<a href="?id=5&amp;nr={t}">Title {t}</a> {desc}'.format(t=title.title_id, desc=match_type)
+                if title.change:
+                    change = '<span class="MatchTitleChange">TITLE CHANGE !!!</span>'
+
+            promotions = ''.join(
+                '<a href="?id=8&amp;nr={p}"><img src="" alt="P{p}"></a>'.format(p=p.promotion_id)
+                for p in match.promotions)
+
+            event, _, location = match.event_name.partition(' @ ')
+            rows.append('''<tr class="TRow{odd}"><td class="TCol">{n}</td><td class="TCol">{date}</td>
+<td class="TCol">{promotions}</td>
+<td class="TCol"><span class="MatchType">{match_type}:</span> <span class="MatchCard">{card}</span>{change}
+<div class="MatchEventLine"><a href="?id=1&amp;nr={event_id}">{event}</a> @ {location}</div></td>
+<td class="TCol">{type}</td></tr>'''.format(
+                odd=i % 2 + 1, n=i + 1, date=match.date.strftime('%d.%m.%Y'), promotions=promotions,
+                match_type=match_type, card=card, change=change, event_id=match.event_id,
+                event=escape(event), location=escape(location), type=escape(match.type)))
+
+        # Cagematch lists 100 matches per page, scraper reads until short page.
+        for offset in range(0, len(rows) + 1, 100):
+            name = path_format.format(wrestler=wrestler_nr, offset=offset)
+            with open(name, 'w') as f:
+                f.write(_page(rows[offset:offset + 100]))
+            files.append(name)
+
+    return files
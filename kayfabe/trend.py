@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    Online score trends.
+
+    Kalman filter state of every wrestler is kept in wrestler_trends table,
+    and advanced in constant time with each new score. Model is the one of
+    kayfabe.maths.batch_kalman_smooth() on daily mean scores, so filtered
+    trend equals last value of re-smoothing whole history.
+
+    State is tuple of (last date, prior mean, prior covariance, day sum,
+    day count): prediction for last date, and scores seen on it. Scores of
+    same day are averaged before update, as smoothing does.
+'''
+
+import logging
+
+from sqlalchemy import asc, desc, func
+
+from . import BASE_SCORE, session
+from .maths import INITIAL_STATE_COVARIANCE, TRANSITION_COVARIANCE, OBSERVATION_COVARIANCE
+from .models import Match, Score, Trend, Wrestler
+
+logger = logging.getLogger(__name__)
+
+
+def advance(state, on, total, count=1):
+    ''' Advance filter state with scores of day.
+
+        :param state:       Filter state, None for wrestler without scores.
+        :param on:          Date of scores, not before last date of state.
+        :param total:       Sum of scores.
+        :param count:       Count of scores.
+
+        :return:            New filter state.
+    '''
+    if state is None:
+        return (on, float(BASE_SCORE), INITIAL_STATE_COVARIANCE, float(total), count)
+
+    (last_date, prior_mean, prior_covariance, day_sum, day_count) = state
+
+    if on == last_date:
+        return (last_date, prior_mean, prior_covariance, day_sum + total, day_count + count)
+    if on < last_date:
+        raise ValueError('Score on %s before trend date %s' % (on, last_date))
+
+    (mean, covariance) = estimate(state)
+    covariance += TRANSITION_COVARIANCE * (on - last_date).days
+
+    return (on, mean, covariance, float(total), count)
+
+
+def estimate(state):
+    ''' Filtered trend of state.
+
+        :return:            Tuple of (mean, covariance).
+    '''
+    (_, prior_mean, prior_covariance, day_sum, day_count) = state
+
+    gain = prior_covariance / (prior_covariance + OBSERVATION_COVARIANCE)
+    mean = prior_mean + gain * (day_sum / day_count - prior_mean)
+
+    return (mean, (1 - gain) * prior_covariance)
+
+
+def load_trends(session=session):
+    ''' Load filter states of all wrestlers.
+
+        :return:            Dict of wrestler nr: state.
+    '''
+    q = session.query(Trend.wrestler_nr, Trend.last_date, Trend.prior_mean, Trend.prior_covariance,
+                      Trend.day_sum, Trend.day_count)
+
+    return {row[0]: tuple(row[1:]) for row in q.all()}
+
+
+def store_trends(states, session=session, batch_size=50000):
+    ''' Insert or replace filter states.
+
+        :param states:      Dict of wrestler nr: state.
+    '''
+    rows = []
+    for (nr, state) in states.items():
+        (mean, covariance) = estimate(state)
+        rows.append({
+            'wrestler_nr': nr, 'mean': mean, 'covariance': covariance,
+            'last_date': state[0], 'prior_mean': state[1], 'prior_covariance': state[2],
+            'day_sum': state[3], 'day_count': state[4]
+        })
+
+    insert = Trend.__table__.insert().prefix_with('OR REPLACE')
+    for start in range(0, len(rows), batch_size):
+        session.execute(insert, rows[start:start+batch_size])
+
+
+def rebuild_trends(session=session):
+    ''' Rebuild trend table by filtering daily scores of every wrestler. '''
+    q = session.query(Score.wrestler_nr, Match.date, func.sum(Score.score), func.count(Score.id)).\
+        join(Match, Match.id == Score.match_id).filter(Match.date != None).\
+        group_by(Score.wrestler_nr, Match.date).order_by(Score.wrestler_nr, asc(Match.date))
+
+    states = {}
+    for (nr, on, total, count) in q.all():
+        states[nr] = advance(states.get(nr), on, total, count)
+
+    session.query(Trend).delete(synchronize_session=False)
+    store_trends(states, session=session)
+
+    logger.debug('Rebuilt trends of %d wrestlers', len(states))
+
+
+def trend_ranking(limit=100, session=session):
+    ''' Wrestlers by filtered score trend.
+
+        :return:            List of (wrestler, trend), best first.
+    '''
+    return session.query(Wrestler, Trend.mean).join(Trend, Trend.wrestler_nr == Wrestler.nr).\
+        order_by(desc(Trend.mean), Wrestler.nr).limit(limit).all()
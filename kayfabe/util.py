@@ -6,7 +6,17 @@ Various functions for model handling.
 from . import session
 from .models import Gimmick, Match, MatchWrestler, Wrestler
 
-from sqlalchemy import asc, desc
+from sqlalchemy import asc, desc, event, text
+
+from contextlib import contextmanager
+
+import logging
+
+# SQLite pragmas for bulk loading. Trades crash safety for speed.
+FAST_LOAD_PRAGMAS = {
+    'journal_mode': 'MEMORY',
+    'synchronous': 'OFF'
+}
 
 
 def get_last_match(wrestler: Wrestler) -> Match:
@@ -19,4 +29,82 @@ def get_gimmick_id(id, gimmick: str) -> int:
     '''Get gimmick ID by gimmick name.'''
     gimmick_query = session.query(Gimmick).filter_by(wrestler_nr=id, gimmick=gimmick)
     if gimmick_query.count() >= 1:
-        return gimmick_query.first().id
\ No newline at end of file
+        return gimmick_query.first().id
+
+
+def bulk_insert(table, columns, rows, session=session, batch_size=50000):
+    '''Insert rows as executemany batches.
+
+    :param table:       Table to insert into.
+    :param columns:     Column names of rows.
+    :param rows:        Sequence of row tuples.
+    '''
+    insert = table.insert()
+    for start in range(0, len(rows), batch_size):
+        session.execute(insert, [dict(zip(columns, row)) for row in rows[start:start+batch_size]])
+
+
+def add_missing_columns(table, session=session):
+    '''Add columns and indexes of model table missing from database table.
+
+    SQLite can only append nullable columns, which is what new score
+    columns are.
+
+    :return:            Names of added columns.
+    '''
+    bind = session.get_bind()
+    existing = set(row[1] for row in session.execute(text('PRAGMA table_info(%s)' % table.name)))
+
+    added = []
+    for column in table.columns:
+        if column.name not in existing:
+            session.execute(text('ALTER TABLE %s ADD COLUMN %s %s' % (
+                table.name, column.name, column.type.compile(dialect=bind.dialect))))
+            added.append(column.name)
+
+    session.commit()
+
+    for index in table.indexes:
+        index.create(bind, checkfirst=True)
+
+    return added
+
+
+@contextmanager
+def fast_load(session=session, **pragmas):
+    '''Context for bulk loading with SQLite pragmas from FAST_LOAD_PRAGMAS.
+
+    Pragmas are set on every connection checked out within context, and
+    restored afterwards. Session must not be in transaction on entry, as
+    connection it holds was checked out before, and SQLite can't change
+    journal mode within transaction. Commit before leaving context too,
+    connections are discarded on exit.
+    '''
+    if session.in_transaction():
+        raise RuntimeError('fast_load() entered with open transaction, commit first')
+
+    pragmas = dict(FAST_LOAD_PRAGMAS, **pragmas)
+    engine = session.get_bind()
+    saved = {}
+
+    def set_pragmas(dbapi_connection, connection_record, connection_proxy):
+        cursor = dbapi_connection.cursor()
+        for (name, value) in pragmas.items():
+            if name not in saved:
+                saved[name] = cursor.execute('PRAGMA {name}'.format(name=name)).fetchone()[0]
+            cursor.execute('PRAGMA {name}={value}'.format(name=name, value=value))
+        cursor.close()
+
+    event.listen(engine, 'checkout', set_pragmas)
+    try:
+        yield
+    finally:
+        event.remove(engine, 'checkout', set_pragmas)
+        engine.dispose()
+
+        # Journal mode may be persistent, set it back.
+        with engine.connect() as connection:
+            for (name, value) in saved.items():
+                connection.exec_driver_sql('PRAGMA {name}={value}'.format(name=name, value=value))
+
+        logging.debug('Restored pragmas %s', saved)
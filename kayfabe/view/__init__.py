@@ -20,6 +20,7 @@ IMAGES_PATH = 'ass/img/'
 
 IMAGE_SIZES = {
     'carousel': (664, 373),
+    'carousel_thumb': (166, 93),
     'thumb': (100,100),
     'favicon': (16,16)
 }
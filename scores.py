@@ -7,105 +7,121 @@
 
 import logging, sys
 
-from sqlalchemy import asc, desc
+from sqlalchemy import asc, desc, func
 
 from kayfabe.models import *
-from kayfabe.scrapper import CageMatch
-from kayfabe import session
+from kayfabe import session, engine
 
 from kayfabe import BASE_SCORE
+from kayfabe.util import add_missing_columns, bulk_insert, fast_load
+from kayfabe.replay import Timeline, stream, stream_parallel, write_scores, checkpoint, clear_scores, unscored_since, \
+    store_current_scores, update_current_scores, rebuild_current_scores, fill_score_deltas, scored_through, mark_scored
+from kayfabe.scoring import ranking_period, previous_period, ensure_window, prune_windows, refresh_windows, update_windows
+from kayfabe.stats import clear_stats_cache
+from kayfabe.stats.cube import update_cube
+from kayfabe.trend import advance, load_trends, store_trends, rebuild_trends
+from kayfabe.rating import ENGINES, KayfabeEngine, \
+    RESOLUTION_PENALTIES, EVENT_MODIFIERS, CHAMPIONSHIP_INCREMENT, DIFFERENCE_MAKER, RUMBLE_LOSERS
 
 import math
 
-from random import randint
-from time import strptime
+from datetime import datetime
+from contextlib import ExitStack
 
-RESOLUTION_PENALTIES={
-    'DQ': 1.5,
-    'COUNT OUT': 1.5
-}
+SCORE_CACHE = {}
 
-EVENT_MODIFIERS={
-    'HOUSE SHOW': 1,
-    'EVENT': 2,
-    'DARK MATCH': 2.5,
-    'TV-SHOW': 4,
-    'PAY PER VIEW': 17
-}
+# SCORE_CACHE holds every scored wrestler, loaded from current score table.
+SCORE_CACHE_LOADED = False
 
-CHAMPIONSHIP_INCREMENT = 1
+# Latest scored (match id, date) of wrestlers, for current score table.
+LAST_MATCHES = {}
 
-DIFFERENCE_MAKER = 5
+# Score rows waiting for bulk insert. None unless in fast-load mode.
+SCORE_BUFFER = None
 
-SCORE_CACHE = {}
+# Trend filter states of wrestlers, see kayfabe.trend. None until loaded.
+TRENDS = None
 
+# Wrestlers with trend advanced since trends were stored.
+TRENDS_CHANGED = set()
 
-def get_wrestler_score(nr):
 
-    if nr in SCORE_CACHE:
-        return SCORE_CACHE[nr]
+def load_score_cache():
+    ''' Load current scores into SCORE_CACHE with single query. '''
+    global SCORE_CACHE_LOADED
 
-    score = session.query(Score).join(Match).filter(Score.wrestler_nr==nr).order_by(desc(Match.date))
+    if not session.query(CurrentScore).first() and session.query(Score).first():
+        logging.info('Building current score table.')
+        rebuild_current_scores()
 
-    if score.count() < 1:
+    SCORE_CACHE.update(session.query(CurrentScore.wrestler_nr, CurrentScore.score).all())
+    SCORE_CACHE_LOADED = True
 
-        not_jobber = session.query(Wrestler).get(nr)
-        if not_jobber:
-            logging.info('No score for wrestler: {name}[{nr}], returning base score of {bs}'.format(name=not_jobber.name, nr=nr, bs=BASE_SCORE))
-        else:
-            logging.debug('No score for jobber [{nr}], returning base score of {bs}'.format(nr=nr, bs=BASE_SCORE))
-        SCORE_CACHE[nr] = BASE_SCORE
-    else:
-        SCORE_CACHE[nr] = score.first().score
-
-    return SCORE_CACHE[nr]
 
+def load_trend_cache():
+    ''' Load trend filter states into TRENDS. '''
+    global TRENDS
 
-def update_score(nr, match, score):
-    score = get_wrestler_score(nr) + score
-    score = max(round(score),1)
+    if not session.query(Trend).first() and session.query(Score).first():
+        logging.info('Building trend table.')
+        rebuild_trends()
 
-    new_score = Score(
-        match_id=match.id,
-        wrestler_nr=nr,
-        score=score
-    )
+    TRENDS = load_trends()
 
-    session.add(new_score)
 
-    SCORE_CACHE[nr] = new_score.score
+def get_wrestler_score(nr):
 
+    if nr in SCORE_CACHE:
+        return SCORE_CACHE[nr]
 
-if __name__ == '__main__':
+    if SCORE_CACHE_LOADED:
+        score = None
+    else:
+        score = session.query(Score).join(Match).filter(Score.wrestler_nr==nr).order_by(desc(Match.date), asc(Match.id), desc(Score.id)).first()
 
-    import argparse
+    if score is None:
+        # Debut. Wrestler isn't looked up, that would cost a query per newcomer.
+        logging.debug('No score for wrestler [{nr}], returning base score of {bs}'.format(nr=nr, bs=BASE_SCORE))
+        SCORE_CACHE[nr] = BASE_SCORE
+    else:
+        SCORE_CACHE[nr] = score.score
 
-    cmdline = argparse.ArgumentParser(description='Update scores.')
+    return SCORE_CACHE[nr]
 
-    cmdline.add_argument('--full', help='Force updating full score table.', action='store_true')
-    cmdline.add_argument('--debug', help='Debug', action='store_true')
 
-    args = cmdline.parse_args()
+def update_score(nr, match, score):
+    before = get_wrestler_score(nr)
+    score = max(round(before + score),1)
 
-    if args.debug:
-        logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+    if SCORE_BUFFER is not None:
+        SCORE_BUFFER.append((match.id, nr, score, score - before))
     else:
-        logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+        session.add(Score(
+            match_id=match.id,
+            wrestler_nr=nr,
+            score=score,
+            delta=score - before
+        ))
 
-    logger = logging.getLogger()
-    debugging = lgger.isEnabledFor(logging.DEBUG)
+    SCORE_CACHE[nr] = score
+    LAST_MATCHES[nr] = (match.id, match.date)
 
-    '''
-    matches = session.query(Match).join(MatchWrestler).join(Wrestler).\
-        distinct(Match.id).order_by(Match.date, desc(Match.id))
+    if TRENDS is not None:
+        TRENDS[nr] = advance(TRENDS.get(nr), match.date, score)
+        TRENDS_CHANGED.add(nr)
 
-    '''
 
-    if args.full:
-        matches = session.query(Match).distinct(Match.id).order_by(asc(Match.date), desc(Match.id))
-    else:
-        last = session.query(Score).order_by(desc(Score.id)).limit(1).one()
-        matches = session.query(Match).distinct(Match.id).order_by(asc(Match.date), desc(Match.id)).filter(Match.id > last.match.id)
+def flush_scores():
+    ''' Bulk insert buffered score rows. '''
+    if SCORE_BUFFER:
+        bulk_insert(Score.__table__, KayfabeEngine.columns, SCORE_BUFFER)
+        SCORE_BUFFER.clear()
+
+
+def score_matches(matches):
+    ''' Score matches one by one, on top of existing scores. '''
+
+    debugging = logging.getLogger().isEnabledFor(logging.DEBUG)
 
     matches_count = matches.count()
 
@@ -143,7 +159,7 @@ if __name__ == '__main__':
             Fuck Rumbles....
         '''
 
-        if len(winners) == 1 and len(losers) > 5:
+        if len(winners) == 1 and len(losers) > RUMBLE_LOSERS:
             rumble_rules = True
 
         if rumble_rules:
@@ -194,9 +210,168 @@ if __name__ == '__main__':
             update_score(loser.wrestler_id, match, -score_base)
 
         if i % 5000 == 0:
-            session.commit()
+            if SCORE_BUFFER is None:
+                session.commit()
+            else:
+                ''' Fast-load keeps single transaction. '''
+                flush_scores()
         i = i + 1
 
+    flush_scores()
+
+    store_current_scores(
+        (nr, SCORE_CACHE[nr], match_id, date) for nr, (match_id, date) in LAST_MATCHES.items()
+    )
+    LAST_MATCHES.clear()
+
+    if TRENDS is not None:
+        store_trends({nr: TRENDS[nr] for nr in TRENDS_CHANGED})
+        TRENDS_CHANGED.clear()
+
     session.commit()
 
+    # Matches were added since statistics were cached.
+    clear_stats_cache()
+
+
+def rescore(from_date=None, processes=None, engines=()):
+    ''' Replay match history into score table.
+
+        :param from_date:   Replay only matches on and after date, starting
+                            from scores stored before it. Full replay if None.
+        :param processes:   Replay independent wrestler groups in parallel.
+        :param engines:     Names of additional rating engines to evaluate
+                            in same pass. Only on full replay.
+    '''
+
+    newest = session.query(func.max(Match.id)).scalar()
+    timeline = Timeline.load(from_date=from_date)
+    logging.info('Replaying %d matches from %s', len(timeline), from_date or 'beginning')
+
+    SCORE_CACHE.clear()
+    if from_date is not None:
+        SCORE_CACHE.update(checkpoint(from_date))
+
+    kayfabe = KayfabeEngine(SCORE_CACHE)
+    others = [ENGINES[name]() for name in engines]
+
+    if processes == 1:
+        results = stream(timeline, [kayfabe] + others)
+    else:
+        results = stream_parallel(timeline, [kayfabe] + others, processes)
+
+    rows = results[0]
+    clear_scores(from_date)
+    write_scores(rows)
+    update_current_scores(timeline, rows, from_date)
+
+    for (other, other_rows) in zip(others, results[1:]):
+        session.query(other.model).delete()
+        write_scores(other_rows, model=other.model, columns=other.columns)
+
+    refresh_windows(from_date)
+
+    rebuild_trends()
+
+    mark_scored(newest)
+
+    session.commit()
+
+    clear_stats_cache()
+
+
+def prepare_database():
+    ''' Create missing tables, and add columns new to existing ones. '''
+    Base.metadata.create_all(engine)
+
+    if 'delta' in add_missing_columns(Score.__table__):
+        logging.info('Computing score deltas.')
+        fill_score_deltas()
+        session.commit()
+
+
+def materialize_rankings():
+    ''' Materialize current and previous ranking windows of site, and drop
+        windows of earlier days nobody reads.
+    '''
+    period = ranking_period(datetime.now().date())
+    windows = [period, previous_period(*period)]
+
+    prune_windows(windows)
+    for window in windows:
+        ensure_window(*window)
+
+    session.commit()
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    cmdline = argparse.ArgumentParser(description='Update scores.')
+
+    cmdline.add_argument('--full', help='Force updating full score table.', action='store_true')
+    cmdline.add_argument('--from-date', help='Rescore matches on and after date (YYYY-MM-DD).',
+                         type=lambda d: datetime.strptime(d, '%Y-%m-%d').date())
+    cmdline.add_argument('--processes', help='Replay worker processes. Defaults to CPU count.', type=int)
+    cmdline.add_argument('--engine', help='Also evaluate rating engine on full update.', action='append',
+                         choices=[name for name in ENGINES if name != KayfabeEngine.name], default=[])
+    cmdline.add_argument('--fast-load', help='Bulk insert scores, with unsafe SQLite pragmas during run.', action='store_true')
+    cmdline.add_argument('--debug', help='Debug', action='store_true')
+
+    args = cmdline.parse_args()
+
+    if args.engine and not args.full:
+        cmdline.error('--engine requires --full')
+
+    if args.debug:
+        logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+    else:
+        logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+
+    logger = logging.getLogger()
+
+    prepare_database()
+
+    '''
+    matches = session.query(Match).join(MatchWrestler).join(Wrestler).\
+        distinct(Match.id).order_by(Match.date, desc(Match.id))
+
+    '''
+
+    with ExitStack() as stack:
+        if args.fast_load:
+            stack.enter_context(fast_load())
+            SCORE_BUFFER = []
+
+        if args.full:
+            rescore(processes=args.processes, engines=args.engine)
+        elif args.from_date:
+            rescore(args.from_date, args.processes)
+        else:
+            first_unscored, last_scored = unscored_since()
+
+            if first_unscored is None:
+                logging.info('No new matches to score.')
+            elif last_scored is None or first_unscored <= last_scored:
+                ''' Backdated matches, replay timeline after them. '''
+                rescore(first_unscored, args.processes)
+            else:
+                last = scored_through()
+                newest = session.query(func.max(Match.id)).scalar()
+                matches = session.query(Match).distinct(Match.id).order_by(asc(Match.date), desc(Match.id)).\
+                    filter(Match.id > last).filter(Match.id <= newest)
+                load_score_cache()
+                load_trend_cache()
+                score_matches(matches)
+
+                update_windows(last)
+                mark_scored(newest)
+                session.commit()
+
+        materialize_rankings()
+
+        update_cube()
+        session.commit()
+
     #for (wrestler_nr,) in session.query(Wrestler.cm).order_by(Wrestler.pwi).slice(554,1).all():
@@ -26,10 +26,13 @@ from time import sleep
 
 import argparse
 
+# Cached cagematch match list pages.
+CACHE_FILE = '/tmp/cm-matches-{wrestler}-{offset}.txt'
+
 def scrape_matches(wrestler_nr, match_offset=0, skip_processed=False):
     print('Processing %d:%d' % (wrestler_nr, match_offset))
 
-    c_file = '/tmp/cm-matches-{wrestler}-{offset}.txt'.format(
+    c_file = CACHE_FILE.format(
         wrestler=wrestler_nr, offset=match_offset
     )
 
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+    Compute weekly rank snapshots of every wrestler, for rank charts.
+    See kayfabe.history.rank_trajectory().
+'''
+
+import logging, sys
+
+from kayfabe import session, engine
+from kayfabe.models import Base
+from kayfabe.history import ScoreHistory, write_rank_snapshots
+from kayfabe.scoring import Ranking
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    cmdline = argparse.ArgumentParser(description='Compute weekly rank snapshots.')
+
+    cmdline.add_argument('--window', help='Ranking window length in days.', type=int, action='append')
+    cmdline.add_argument('--debug', help='Debug', action='store_true')
+
+    args = cmdline.parse_args()
+
+    if args.debug:
+        logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+    else:
+        logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+
+    Base.metadata.create_all(engine)
+
+    history = ScoreHistory.load()
+
+    for window in args.window or [Ranking.window.days]:
+        count = write_rank_snapshots(window, history)
+        logging.info('Wrote %d rank snapshots of %d day window', count, window)
+
+    session.commit()